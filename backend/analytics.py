@@ -0,0 +1,360 @@
+import asyncio
+import datetime
+import os
+from collections import Counter, namedtuple
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import (
+    AsyncSessionLocal, env_flag, Listing, LeaseFormSubmission, SellFormSubmission, ConsultationFormSubmission,
+    DealInquirySubmission, DemoInquirySubmission, InquiryDailyRollup, SubmissionDailyRollup, RollupWatermark,
+)
+
+# Lead tables folded into the rollups: (model, form type, zip code column,
+# listing type and id column for inquiries)
+RollupSource = namedtuple("RollupSource", ["model", "form_type", "zip_column", "listing_type", "listing_column"])
+
+ROLLUP_SOURCES = (
+    RollupSource(LeaseFormSubmission, "lease", "zip_code", None, None),
+    RollupSource(SellFormSubmission, "sell", None, None, None),
+    RollupSource(ConsultationFormSubmission, "consultation", "zip_code", None, None),
+    RollupSource(DealInquirySubmission, "deal inquiry", None, "deal", "deal_id"),
+    RollupSource(DemoInquirySubmission, "demo inquiry", None, "demo", "demo_id"),
+)
+
+ANALYTICS_TYPES = {"deals": "deal", "demos": "demo"}
+
+# Days covered when a request gives no start date
+DEFAULT_ANALYTICS_DAYS = 30
+
+MAX_ANALYTICS_ROWS = 1000
+
+class AnalyticsQuery(BaseModel):
+    """Date range (inclusive, UTC days) accepted by the /analytics endpoints."""
+    start: Optional[datetime.date] = None
+    end: Optional[datetime.date] = None
+
+    def date_range(self):
+        end = self.end or datetime.datetime.utcnow().date()
+        start = self.start or end - datetime.timedelta(days=DEFAULT_ANALYTICS_DAYS - 1)
+        return start, end
+
+class InquiryRankingQuery(AnalyticsQuery):
+    listing_type: Optional[Literal["deals", "demos"]] = None
+    limit: int = Field(20, ge=1, le=MAX_ANALYTICS_ROWS)
+
+class InquirySeriesQuery(AnalyticsQuery):
+    listing_type: Optional[Literal["deals", "demos"]] = None
+    listing_id: Optional[int] = None
+
+class SubmissionRollupQuery(AnalyticsQuery):
+    group_by: Literal["day", "form_type", "zip_prefix"] = "day"
+    form_type: Optional[Literal["lease", "sell", "consultation", "deal inquiry", "demo inquiry"]] = None
+
+def zip_prefix(zip_code):
+    """First three digits of a zip code, or "" when there aren't three."""
+    digits = "".join(character for character in (zip_code or "") if character.isdigit())
+    return digits[:3] if len(digits) >= 3 else ""
+
+def _columns(source):
+    columns = [source.model.id, source.model.created_at]
+    if source.zip_column:
+        columns.append(getattr(source.model, source.zip_column))
+    if source.listing_column:
+        columns.append(getattr(source.model, source.listing_column))
+    return columns
+
+def count_rows(source, rows):
+    """
+    Aggregate lead rows of one source into rollup increments.
+
+    Returns:
+        tuple: (Counter of (day, form type, zip prefix) -> submissions,
+        Counter of (day, listing type, listing id) -> inquiries)
+    """
+    submissions, inquiries = Counter(), Counter()
+    for row in rows:
+        day = row.created_at.date()
+        zip_code = getattr(row, source.zip_column) if source.zip_column else None
+        submissions[(day, source.form_type, zip_prefix(zip_code))] += 1
+        if source.listing_column:
+            listing_id = getattr(row, source.listing_column)
+            if listing_id is not None:
+                inquiries[(day, source.listing_type, listing_id)] += 1
+    return submissions, inquiries
+
+def upsert_increments(dialect, model, key_columns, count_column, counts):
+    """
+    Build an INSERT that adds counts to existing rollup rows, creating missing ones.
+
+    Uses ON CONFLICT DO UPDATE on SQLite and ON DUPLICATE KEY UPDATE on MySQL.
+
+    Returns:
+        tuple: (statement, list of parameter dicts) for an executemany
+    """
+    rows = [dict(zip(key_columns, key), **{count_column: count}) for key, count in counts.items()]
+    table = model.__table__
+    if dialect == "mysql":
+        statement = mysql_insert(table)
+        statement = statement.on_duplicate_key_update(
+            {count_column: table.c[count_column] + statement.inserted[count_column]}
+        )
+    else:
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={count_column: table.c[count_column] + statement.excluded[count_column]},
+        )
+    return statement, rows
+
+class RollupCompactor:
+    """
+    Folds new leads into the daily rollup tables.
+
+    Each lead table has a watermark: the highest id already counted. A
+    pass reads the leads above it in id order, adds their counts to the
+    rollups with upserts and moves the watermark, all in one transaction.
+    The watermark only moves if nobody else moved it first, so several
+    compactors (one per web process) never count a lead twice.
+
+    Leads younger than settle_seconds are left for the next pass, giving
+    transactions that took a lower id but committed later time to appear.
+    Readers add those recent leads themselves (see tail_counts), so the
+    analytics are exact either way.
+    """
+
+    def __init__(self, session_factory, interval=60.0, batch_size=5000, settle_seconds=10.0):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self._task = None
+        self._stopping = None
+        self.leads_compacted = 0
+        self.passes = 0
+
+    async def start(self):
+        """Start compacting in the background."""
+        if self._task is not None:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the current pass."""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"Error compacting lead rollups: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def compact(self):
+        """Fold every settled lead above the watermarks into the rollups."""
+        compacted = 0
+        for source in ROLLUP_SOURCES:
+            while True:
+                count = await self._compact_batch(source)
+                compacted += count
+                if count < self.batch_size:
+                    break
+        self.passes += 1
+        self.leads_compacted += compacted
+        return compacted
+
+    async def _compact_batch(self, source):
+        settled_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.settle_seconds)
+        async with self.session_factory() as db:
+            watermark = await read_watermark(db, source)
+            rows = (await db.execute(
+                select(*_columns(source))
+                .where(source.model.id > watermark)
+                .order_by(source.model.id)
+                .limit(self.batch_size)
+            )).all()
+            # Stop at the first unsettled lead so the watermark never passes it
+            settled = []
+            for row in rows:
+                if row.created_at is None or row.created_at > settled_before:
+                    break
+                settled.append(row)
+            if not settled:
+                await db.commit()
+                return 0
+
+            dialect = db.get_bind().dialect.name
+            submissions, inquiries = count_rows(source, settled)
+            for model, key_columns, count_column, counts in (
+                (SubmissionDailyRollup, ("day", "form_type", "zip_prefix"), "submissions", submissions),
+                (InquiryDailyRollup, ("day", "listing_type", "listing_id"), "inquiries", inquiries),
+            ):
+                if counts:
+                    statement, parameters = upsert_increments(dialect, model, key_columns, count_column, counts)
+                    await db.execute(statement, parameters)
+
+            moved = await db.execute(
+                update(RollupWatermark)
+                .where(RollupWatermark.source == source.model.__tablename__, RollupWatermark.last_id == watermark)
+                .values(last_id=settled[-1].id, updated_at=datetime.datetime.utcnow())
+            )
+            if moved.rowcount != 1:
+                # Another compactor got there first; undo our increments
+                await db.rollback()
+                return 0
+            await db.commit()
+        return len(settled)
+
+    def stats(self):
+        return {"passes": self.passes, "leads_compacted": self.leads_compacted, "interval_seconds": self.interval}
+
+async def read_watermark(db, source):
+    """Return a lead table's watermark, creating it at zero the first time."""
+    name = source.model.__tablename__
+    last_id = (await db.execute(select(RollupWatermark.last_id).where(RollupWatermark.source == name))).scalar()
+    if last_id is None:
+        # Another compactor may be creating it at the same moment
+        table = RollupWatermark.__table__
+        if db.get_bind().dialect.name == "mysql":
+            statement = mysql_insert(table).prefix_with("IGNORE")
+        else:
+            statement = sqlite_insert(table).on_conflict_do_nothing(index_elements=["source"])
+        await db.execute(statement.values(source=name, last_id=0, updated_at=datetime.datetime.utcnow()))
+        last_id = (await db.execute(select(RollupWatermark.last_id).where(RollupWatermark.source == name))).scalar_one()
+    return last_id
+
+async def tail_counts(db, sources, start, end):
+    """
+    Count the leads above the watermarks that fall in [start, end].
+
+    These are the leads the compactor hasn't folded in yet, so adding
+    them to the rollups gives exact, current numbers.
+    """
+    submissions, inquiries = Counter(), Counter()
+    watermarks = dict((await db.execute(select(RollupWatermark.source, RollupWatermark.last_id))).all())
+    for source in sources:
+        rows = (await db.execute(
+            select(*_columns(source))
+            .where(
+                source.model.id > watermarks.get(source.model.__tablename__, 0),
+                source.model.created_at >= datetime.datetime.combine(start, datetime.time.min),
+                source.model.created_at < datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min),
+            )
+        )).all()
+        source_submissions, source_inquiries = count_rows(source, rows)
+        submissions.update(source_submissions)
+        inquiries.update(source_inquiries)
+    return submissions, inquiries
+
+def _inquiry_sources(listing_type):
+    return [source for source in ROLLUP_SOURCES if source.listing_type and listing_type in (None, source.listing_type)]
+
+async def inquiry_ranking(db, params: InquiryRankingQuery):
+    """Listings with the most inquiries in the date range, with their make, model and year."""
+    start, end = params.date_range()
+    listing_type = ANALYTICS_TYPES.get(params.listing_type)
+    statement = (
+        select(InquiryDailyRollup.listing_type, InquiryDailyRollup.listing_id, func.sum(InquiryDailyRollup.inquiries))
+        .where(InquiryDailyRollup.day >= start, InquiryDailyRollup.day <= end)
+        .group_by(InquiryDailyRollup.listing_type, InquiryDailyRollup.listing_id)
+    )
+    if listing_type:
+        statement = statement.where(InquiryDailyRollup.listing_type == listing_type)
+    totals = Counter({(row[0], row[1]): int(row[2]) for row in await db.execute(statement)})
+    _, tail = await tail_counts(db, _inquiry_sources(listing_type), start, end)
+    for (_, row_type, listing_id), count in tail.items():
+        totals[(row_type, listing_id)] += count
+
+    ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:params.limit]
+    ids = [listing_id for (_, listing_id), _ in ranked]
+    listings = {
+        row.id: row for row in await db.execute(
+            select(Listing.id, Listing.make, Listing.model, Listing.year).where(Listing.id.in_(ids))
+        )
+    } if ids else {}
+    results = []
+    for (row_type, listing_id), count in ranked:
+        listing = listings.get(listing_id)
+        results.append({
+            "listing_type": row_type,
+            "listing_id": listing_id,
+            "inquiries": count,
+            # None once the listing has been deleted
+            "make": listing.make if listing else None,
+            "model": listing.model if listing else None,
+            "year": listing.year if listing else None,
+        })
+    return results
+
+async def inquiry_series(db, params: InquirySeriesQuery):
+    """Inquiries per day in the date range, for one listing or all of them."""
+    start, end = params.date_range()
+    listing_type = ANALYTICS_TYPES.get(params.listing_type)
+    statement = (
+        select(InquiryDailyRollup.day, func.sum(InquiryDailyRollup.inquiries))
+        .where(InquiryDailyRollup.day >= start, InquiryDailyRollup.day <= end)
+        .group_by(InquiryDailyRollup.day)
+    )
+    if listing_type:
+        statement = statement.where(InquiryDailyRollup.listing_type == listing_type)
+    if params.listing_id is not None:
+        statement = statement.where(InquiryDailyRollup.listing_id == params.listing_id)
+    days = Counter({row[0]: int(row[1]) for row in await db.execute(statement)})
+    _, tail = await tail_counts(db, _inquiry_sources(listing_type), start, end)
+    for (day, _, listing_id), count in tail.items():
+        if params.listing_id is None or listing_id == params.listing_id:
+            days[day] += count
+    return [{"day": day, "inquiries": count} for day, count in sorted(days.items())]
+
+async def submission_rollup(db, params: SubmissionRollupQuery):
+    """Submissions in the date range grouped by day, form type or zip code prefix."""
+    start, end = params.date_range()
+    group_column = getattr(SubmissionDailyRollup, params.group_by)
+    statement = (
+        select(group_column, func.sum(SubmissionDailyRollup.submissions))
+        .where(SubmissionDailyRollup.day >= start, SubmissionDailyRollup.day <= end)
+        .group_by(group_column)
+    )
+    if params.form_type:
+        statement = statement.where(SubmissionDailyRollup.form_type == params.form_type)
+    groups = Counter({row[0]: int(row[1]) for row in await db.execute(statement)})
+    sources = [source for source in ROLLUP_SOURCES if params.form_type in (None, source.form_type)]
+    tail, _ = await tail_counts(db, sources, start, end)
+    position = ("day", "form_type", "zip_prefix").index(params.group_by)
+    for key, count in tail.items():
+        groups[key[position]] += count
+    return [{params.group_by: key, "submissions": count} for key, count in sorted(groups.items())]
+
+rollup_compactor = RollupCompactor(
+    AsyncSessionLocal,
+    interval=float(os.getenv("ANALYTICS_ROLLUP_INTERVAL_SECONDS", "60")),
+)
+
+# Whether the web app runs the compactor; turn off where a separate process does
+ROLLUP_COMPACTOR_IN_WEB = env_flag("ANALYTICS_ROLLUP_IN_WEB", "true")
+
+async def run_forever():
+    """Run the rollup compactor until interrupted."""
+    await rollup_compactor.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await rollup_compactor.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,61 @@
+"""
+Benchmark for the in-memory rate limiter.
+
+Takes a token for each of `keys` distinct client addresses, then for
+random repeat clients, and prints the cost per request and the store
+size at each step. The cost stays flat as the number of distinct clients
+grows past the store's max_keys, while memory stays bounded by it.
+
+Usage:
+    python bench_rate_limit.py [max_keys] [keys]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from rate_limit import MemoryBucketStore, RateLimiter
+
+def measure(label, store, keys, now):
+    """Take one token per key and print nanoseconds per take."""
+    start = time.perf_counter()
+    for key in keys:
+        store.consume(key, 5, 5 / 60, now)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<24} {elapsed / len(keys) * 1e9:>8,.0f} ns/request  {len(store.buckets):>10,} buckets  {store.evictions:>10,} evicted")
+
+def scope(address):
+    return {"type": "http", "method": "POST", "path": "/submit_form/", "headers": [(b"x-forwarded-for", address.encode())]}
+
+async def measure_limiter(limiter, scopes):
+    """Run scopes through RateLimiter.check and print microseconds per request."""
+    start = time.perf_counter()
+    for request in scopes:
+        await limiter.check(request)
+    elapsed = time.perf_counter() - start
+    print(f"  {len(scopes):,} requests  {elapsed / len(scopes) * 1e6:>8.2f} us/request  {limiter.limited:,} limited")
+
+def main():
+    max_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 3000000
+    store = MemoryBucketStore(max_keys)
+    now = time.monotonic()
+
+    print(f"MemoryBucketStore.consume (max_keys={max_keys:,})")
+    step = 10000
+    seen = 0
+    while seen < total:
+        batch = [f"/submit_form/|10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(seen, seen + step)]
+        measure(f"{seen + step:,} distinct", store, batch, now)
+        seen += step
+        step = min(step * 10, total - seen) or step
+
+    recent = [f"/submit_form/|10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(total - max_keys, total)]
+    measure("repeat clients", store, random.choices(recent, k=100000), now)
+
+    print("RateLimiter.check, 10 clients sharing one bucket each")
+    limiter = RateLimiter(MemoryBucketStore(max_keys), proxy_hops=1)
+    asyncio.run(measure_limiter(limiter, [scope(f"203.0.113.{i % 10}") for i in range(100000)]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark for the list endpoint serialization paths.
+
+Compares the old path (build dicts, validate them against the
+response_model, encode with json.dumps the way FastAPI's JSONResponse
+does) with the precompiled RowSerializer path, and prints rows/sec for each.
+
+Usage:
+    python bench_serialization.py [rows] [repeats]
+"""
+import datetime
+import json
+import sys
+import time
+from typing import List
+from pydantic import TypeAdapter
+
+from database import Deal, DealInquirySubmission, Tag
+from main import DealInquiryResponse, ListingResponse, deal_inquiry_serializer, listing_serializer
+
+def make_deals(count):
+    """Build transient Deal rows with a few tags each."""
+    tags = [Tag(name=name) for name in ("Electric", "Hybrid", "Luxury", "SUV", "Sedan")]
+    return [
+        Deal(
+            id=i,
+            make="BMW",
+            model=f"X{i % 7}",
+            year=2020 + i % 5,
+            image_url=f"https://example.com/deals/{i}.jpg",
+            lease_price=300.0 + i % 500,
+            term=36,
+            down_payment=2500.0,
+            mileage=10000,
+            msrp=45000.0 + i,
+            savings=1500.0,
+            tags=tags[i % 3:i % 3 + 2],
+            description="Lease special with premium package and driver assistance.",
+        )
+        for i in range(count)
+    ]
+
+def make_inquiries(count):
+    """Build transient DealInquirySubmission rows."""
+    created_at = datetime.datetime(2024, 1, 1)
+    return [
+        DealInquirySubmission(
+            id=i,
+            created_at=created_at + datetime.timedelta(minutes=i),
+            first_name="Jane",
+            last_name="Doe",
+            email=f"jane{i}@example.com",
+            phone_number="555-0100",
+            deal_id=i % 50,
+            vehicle_year=2024,
+            vehicle_make="BMW",
+            vehicle_model="X5",
+            lease_price=699.0,
+            term=36,
+            down_payment=5000.0,
+            mileage=12000,
+            msrp=67900.0,
+            savings=None,
+        )
+        for i in range(count)
+    ]
+
+def response_model_path(adapter, dicts):
+    """Mirror FastAPI's response_model handling: validate, dump to JSON-able data, json.dumps."""
+    validated = adapter.validate_python(dicts, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def measure(label, func, rows, repeats):
+    """Run func `repeats` times and print the best rows/sec."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<14} {len(rows) / best:>12,.0f} rows/sec")
+    return best
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    deals = make_deals(count)
+    deal_adapter = TypeAdapter(List[ListingResponse])
+    print(f"GET /deals/ ({count} rows)")
+    before = measure("response_model", lambda: response_model_path(
+        deal_adapter, [listing_serializer.to_dict(deal) for deal in deals]
+    ), deals, repeats)
+    after = measure("RowSerializer", lambda: listing_serializer.dump(deals), deals, repeats)
+    print(f"  speedup        {before / after:>12.1f}x")
+
+    inquiries = make_inquiries(count)
+    inquiry_adapter = TypeAdapter(List[DealInquiryResponse])
+    print(f"GET /deal_inquiries/ ({count} rows)")
+    before = measure("response_model", lambda: response_model_path(inquiry_adapter, inquiries), inquiries, repeats)
+    after = measure("RowSerializer", lambda: deal_inquiry_serializer.dump(inquiries), inquiries, repeats)
+    print(f"  speedup        {before / after:>12.1f}x")
+
+if __name__ == "__main__":
+    main()
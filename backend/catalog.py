@@ -0,0 +1,167 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Listing, Tag
+from pagination import decode_cursor, encode_cursor, fetch_page, keyset_after
+
+# Largest page a client can request from the catalog endpoints
+MAX_PAGE_SIZE = 500
+
+# Columns a client may sort by; prefix with "-" for descending order
+SORTABLE_COLUMNS = ("id", "created_at", "year", "lease_price", "msrp", "down_payment", "term", "mileage", "deal_score")
+
+# (column, lower bound parameter, upper bound parameter)
+RANGE_FILTERS = (
+    ("year", "year_min", "year_max"),
+    ("lease_price", "lease_price_min", "lease_price_max"),
+    ("msrp", "msrp_min", "msrp_max"),
+    ("down_payment", "down_payment_min", "down_payment_max"),
+)
+
+class ListingFilters(BaseModel):
+    """Filter, sort and page size parameters shared by the catalog endpoints."""
+    make: Optional[str] = None
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    lease_price_min: Optional[float] = None
+    lease_price_max: Optional[float] = None
+    msrp_min: Optional[float] = None
+    msrp_max: Optional[float] = None
+    down_payment_min: Optional[float] = None
+    down_payment_max: Optional[float] = None
+    term: Optional[int] = None
+    mileage: Optional[int] = None
+    tags: List[str] = []
+    tags_match: Literal["any", "all"] = "any"
+    sort: str = Field("id", pattern=r"^-?(" + "|".join(SORTABLE_COLUMNS) + r")$")
+    limit: Optional[int] = Field(None, ge=1, le=MAX_PAGE_SIZE)
+
+class ListingQuery(ListingFilters):
+    """Query parameters accepted by GET /deals/ and GET /demos/."""
+    cursor: Optional[str] = None
+
+def tag_filter(model, tags, match="any"):
+    """
+    Match listings tagged with any/all of the given tag names.
+
+    Resolves the tags through the (tag_id, listing_id) index on the link
+    table and filters listings by id, rather than scanning every listing.
+    """
+    names = list(dict.fromkeys(tags))
+    links = model.tags.property.secondary
+    matches = (
+        select(links.c.listing_id)
+        .join(Tag, Tag.id == links.c.tag_id)
+        .where(Tag.name.in_(names))
+    )
+    if match == "all":
+        matches = matches.group_by(links.c.listing_id).having(func.count(links.c.tag_id) == len(names))
+    return model.id.in_(matches)
+
+def filter_listings(query, model, params: ListingFilters):
+    """Apply the make, range, term, mileage and tag filters of a query, plus any the sort needs."""
+    if params.make:
+        query = query.where(model.make == params.make)
+    for column_name, low_param, high_param in RANGE_FILTERS:
+        column = getattr(model, column_name)
+        low = getattr(params, low_param)
+        high = getattr(params, high_param)
+        if low is not None:
+            query = query.where(column >= low)
+        if high is not None:
+            query = query.where(column <= high)
+    if params.term is not None:
+        query = query.where(model.term == params.term)
+    if params.mileage is not None:
+        query = query.where(model.mileage == params.mileage)
+    if params.tags:
+        query = query.where(tag_filter(model, params.tags, params.tags_match))
+    if params.sort.lstrip("-") == "deal_score":
+        # Listings without an MSRP or term have no score to rank by
+        query = query.where(model.deal_score.isnot(None))
+    return query
+
+def sort_order(model, params: ListingFilters):
+    """
+    Return the columns a query is sorted by and whether it is descending.
+
+    Ties are always broken on id so the order (and therefore the cursor) is stable.
+    """
+    descending = params.sort.startswith("-")
+    sort_name = params.sort.lstrip("-")
+    sort_columns = [model.id] if sort_name == "id" else [getattr(model, sort_name), model.id]
+    return sort_columns, descending
+
+def order_clauses(sort_columns, descending):
+    return [column.desc() if descending else column.asc() for column in sort_columns]
+
+async def query_listings(db: AsyncSession, model, params: ListingQuery):
+    """
+    Run a filtered, sorted and optionally paged query against a listing table.
+
+    Args:
+        db: Database session
+        model: Listing model class (Deal or Demo)
+        params: Parsed query parameters
+
+    Returns:
+        tuple: (list of rows, cursor for the next page or None)
+    """
+    query = filter_listings(select(model), model, params)
+    sort_columns, descending = sort_order(model, params)
+
+    if params.cursor:
+        values = decode_cursor(params.cursor, [column.type.python_type for column in sort_columns])
+        query = query.where(keyset_after(sort_columns, values, descending))
+
+    query = query.order_by(*order_clauses(sort_columns, descending))
+
+    if params.limit is None:
+        return (await db.execute(query)).scalars().all(), None
+    return await fetch_page(db, query, sort_columns, params.limit)
+
+async def query_listings_by_type(db: AsyncSession, params: ListingFilters):
+    """
+    Fetch the first page of deals and of demos in one query.
+
+    With a limit, each type's rows are ranked with a window function and
+    only the first limit + 1 of each come back, so both pages cost a
+    single round trip.
+
+    Returns:
+        dict: listing type -> (list of rows, cursor for the next page or None)
+    """
+    sort_columns, descending = sort_order(Listing, params)
+    order = order_clauses(sort_columns, descending)
+    if params.limit is None:
+        query = filter_listings(select(Listing), Listing, params).order_by(Listing.listing_type, *order)
+    else:
+        ranked = filter_listings(
+            select(
+                Listing.id,
+                func.row_number().over(partition_by=Listing.listing_type, order_by=order).label("position"),
+            ),
+            Listing,
+            params,
+        ).subquery()
+        query = (
+            select(Listing)
+            .join(ranked, ranked.c.id == Listing.id)
+            .where(ranked.c.position <= params.limit + 1)
+            .order_by(Listing.listing_type, *order)
+        )
+
+    rows_by_type = {"deal": [], "demo": []}
+    for listing in (await db.execute(query)).scalars():
+        rows_by_type[listing.listing_type].append(listing)
+
+    pages = {}
+    for listing_type, rows in rows_by_type.items():
+        next_cursor = None
+        if params.limit is not None and len(rows) > params.limit:
+            rows = rows[:params.limit]
+            next_cursor = encode_cursor(*[getattr(rows[-1], column.key) for column in sort_columns])
+        pages[listing_type] = (rows, next_cursor)
+    return pages
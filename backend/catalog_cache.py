@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from collections import OrderedDict, namedtuple
+
+# A cached catalog response and the ETag it was served with
+CacheEntry = namedtuple("CacheEntry", ["value", "etag"])
+
+class CatalogCache:
+    """
+    Read-through cache for catalog list responses.
+
+    Each namespace ("deals", "demos") carries a version number that the
+    admin write endpoints bump after committing, which retires every
+    cached response for that namespace at once. Concurrent misses for the
+    same key share a single load, so a burst of requests right after an
+    edit costs one database query.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        # Distinguishes this process's ETags from those of a previous run,
+        # since versions start again at zero after a restart
+        self._boot_id = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, namespace):
+        """Return the current version of a namespace."""
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        """Invalidate every cached response in a namespace and return the new version."""
+        self._versions[namespace] = self.version(namespace) + 1
+        for key in [key for key in self._entries if key[0] == namespace]:
+            del self._entries[key]
+        return self._versions[namespace]
+
+    def etag(self, namespace, params_key, version=None):
+        """Build the ETag for a response in a namespace at the given (or current) version."""
+        if version is None:
+            version = self.version(namespace)
+        digest = hashlib.sha1(params_key.encode()).hexdigest()[:16]
+        return f'"{namespace}-{self._boot_id}-{version}-{digest}"'
+
+    async def get_or_load(self, namespace, params_key, loader):
+        """
+        Return the cached entry for a key, calling `loader` on a miss.
+
+        Args:
+            namespace: Cache namespace, bumped on writes
+            params_key: Canonical string form of the request parameters
+            loader: Coroutine function producing the response value
+
+        Returns:
+            CacheEntry: The response value and its ETag
+        """
+        version = self.version(namespace)
+        key = (namespace, version, params_key)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        # Another request is already loading this key, so wait for its result
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            entry = CacheEntry(await loader(), self.etag(namespace, params_key, version))
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            pending.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        pending.set_result(entry)
+        # Only keep the result if no write landed while it was loading
+        if self.version(namespace) == version:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+catalog_cache = CatalogCache(max_entries=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "256")))
@@ -0,0 +1,279 @@
+import csv
+import io
+import json
+import math
+from typing import Optional, Union
+from pydantic import BaseModel, ValidationError, field_validator
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from database import SessionLocal, Deal, Demo, Tag, deal_score, get_or_create_tags, split_tags
+
+# Import name -> model
+IMPORT_TABLES = {
+    "deals": Deal,
+    "demos": Demo,
+}
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+# Columns that together identify a listing across imports. There is no
+# trim column, so two trims of the same model and term are one listing
+NATURAL_KEY = ("year", "make", "model", "term")
+
+# Columns an import file sets, besides tags
+IMPORT_COLUMNS = (
+    "make", "model", "year", "image_url", "lease_price", "term",
+    "down_payment", "mileage", "msrp", "savings", "description",
+)
+
+# Ids per IN (...) list and rows per executemany batch
+CHUNK_SIZE = 1000
+
+# Changes of each kind listed in an import report
+REPORT_SAMPLE_SIZE = 50
+
+class ImportRow(BaseModel):
+    """One listing in an import file; same fields as ListingCreateRequest."""
+    make: str
+    model: str
+    year: int
+    image_url: str
+    lease_price: float
+    term: int
+    down_payment: float
+    mileage: int
+    msrp: float
+    savings: Optional[float] = None
+    tags: Optional[Union[str, list[str]]] = None
+    description: Optional[str] = None
+
+    @field_validator("savings", "description", "tags", mode="before")
+    @classmethod
+    def empty_as_none(cls, value):
+        # CSV has no null, so empty cells mean "not set"
+        return None if value == "" else value
+
+    @field_validator("make", "model")
+    @classmethod
+    def strip(cls, value):
+        return value.strip()
+
+    def tag_names(self):
+        if isinstance(self.tags, list):
+            return split_tags(",".join(self.tags))
+        return split_tags(self.tags)
+
+def natural_key(values):
+    """Key matching a listing across imports; make and model compare case-insensitively."""
+    return (values["year"], (values["make"] or "").lower(), (values["model"] or "").lower(), values["term"])
+
+def _differs(name, new, old):
+    if name == "tags":
+        return sorted(new) != sorted(old)
+    if isinstance(new, float) and isinstance(old, float):
+        # Float columns are single precision on MySQL, so compare loosely
+        return not math.isclose(new, old, rel_tol=1e-6)
+    return new != old
+
+def parse_rows(data: bytes, import_format: str):
+    """
+    Parse and validate an import file.
+
+    Returns:
+        tuple: (list of (line number, ImportRow), list of error dicts)
+    """
+    text = data.decode("utf-8-sig")
+    if import_format == "csv":
+        # Line 1 is the header
+        records = enumerate(csv.DictReader(io.StringIO(text)), start=2)
+    else:
+        records = ((number, line) for number, line in enumerate(text.splitlines(), start=1) if line.strip())
+
+    rows, errors = [], []
+    for line, record in records:
+        try:
+            if import_format == "ndjson":
+                record = json.loads(record)
+            rows.append((line, ImportRow.model_validate(record)))
+        except (ValueError, ValidationError) as e:
+            errors.append({"line": line, "error": str(e)})
+    return rows, errors
+
+def load_current(db, model):
+    """
+    Return the table's listings as plain dicts keyed by natural key.
+
+    Listings sharing a key beyond the first (lowest id) are returned
+    separately, since an import can only keep one of them.
+    """
+    links = model.tags.property.secondary
+    columns = [model.id] + [getattr(model, name) for name in IMPORT_COLUMNS]
+    tag_names = {}
+    for listing_id, name in db.execute(
+        select(links.c.listing_id, Tag.name)
+        .join(Tag, Tag.id == links.c.tag_id)
+        .join(model, model.id == links.c.listing_id)
+        .order_by(Tag.name)
+    ):
+        tag_names.setdefault(listing_id, []).append(name)
+
+    current, duplicates = {}, []
+    for row in db.execute(select(*columns).order_by(model.id)):
+        values = dict(row._mapping)
+        values["tags"] = tag_names.get(values["id"], [])
+        key = natural_key(values)
+        if key in current:
+            duplicates.append(values)
+        else:
+            current[key] = values
+    return current, duplicates
+
+def plan_import(db, model, rows, delete_missing=False):
+    """
+    Diff validated import rows against the table.
+
+    Returns:
+        dict: "insert", "update" and "delete" lists, "unchanged" count and
+        any "errors" (duplicate keys within the file)
+    """
+    current, duplicates = load_current(db, model)
+    plan = {"insert": [], "update": [], "delete": [], "unchanged": 0, "errors": []}
+    seen = {}
+    for line, row in rows:
+        values = row.model_dump(include=set(IMPORT_COLUMNS))
+        values["tags"] = row.tag_names()
+        key = natural_key(values)
+        if key in seen:
+            plan["errors"].append({"line": line, "error": f"Duplicate of line {seen[key]} for {list(key)}"})
+            continue
+        seen[key] = line
+
+        existing = current.get(key)
+        if existing is None:
+            plan["insert"].append(values)
+            continue
+        changed = [name for name in IMPORT_COLUMNS + ("tags",) if _differs(name, values[name], existing[name])]
+        if changed:
+            plan["update"].append({"id": existing["id"], "changed": changed, **values})
+        else:
+            plan["unchanged"] += 1
+
+    if delete_missing:
+        plan["delete"] = [values for key, values in current.items() if key not in seen] + duplicates
+    return plan
+
+def _row_values(values):
+    """Column values written for an import row, with its deal_score."""
+    row = {name: values[name] for name in IMPORT_COLUMNS}
+    row["deal_score"] = deal_score(values["lease_price"], values["down_payment"], values["term"], values["msrp"])
+    return row
+
+def _chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def apply_import(db, model, plan):
+    """
+    Write an import plan with batched statements, in the caller's transaction.
+
+    Inserts and updates are each one executemany statement per chunk;
+    tag links of every inserted or changed listing are replaced in bulk.
+    """
+    # Deals and demos share one table; statements against it go by id,
+    # except inserts, which set the type
+    table = model.__table__
+    listing_type = model.__mapper__.polymorphic_identity
+    links = model.tags.property.secondary
+
+    if plan["delete"]:
+        for ids in _chunks([values["id"] for values in plan["delete"]]):
+            db.execute(delete(links).where(links.c.listing_id.in_(ids)))
+            db.execute(delete(table).where(table.c.id.in_(ids)))
+
+    for batch in _chunks(plan["update"]):
+        db.execute(
+            update(table).where(table.c.id == bindparam("listing_id")),
+            [{"listing_id": values["id"], **_row_values(values)} for values in batch],
+        )
+
+    for batch in _chunks(plan["insert"]):
+        db.execute(insert(table), [
+            {"listing_type": listing_type, **_row_values(values)} for values in batch
+        ])
+
+    # Inserts don't return ids on every backend (MySQL has no RETURNING),
+    # so look the new listings up by natural key
+    ids = {}
+    if plan["insert"]:
+        inserted_keys = {natural_key(values) for values in plan["insert"]}
+        for row in db.execute(select(model.id, *[getattr(model, name) for name in NATURAL_KEY])):
+            key = natural_key(row._mapping)
+            if key in inserted_keys:
+                ids[key] = row.id
+
+    retagged = [(ids[natural_key(values)], values["tags"]) for values in plan["insert"]]
+    retagged += [(values["id"], values["tags"]) for values in plan["update"] if "tags" in values["changed"]]
+    names = sorted({name for _, tag_names in retagged for name in tag_names})
+    tag_ids = {tag.name: tag.id for tag in get_or_create_tags(db, names)}
+    for batch in _chunks(retagged):
+        db.execute(delete(links).where(links.c.listing_id.in_([listing_id for listing_id, _ in batch])))
+        link_rows = [
+            {"listing_id": listing_id, "tag_id": tag_ids[name]}
+            for listing_id, tag_names in batch for name in tag_names
+        ]
+        if link_rows:
+            db.execute(insert(links), link_rows)
+
+def import_report(table, plan, parse_errors, dry_run, row_count):
+    """Summarize an import plan, with a sample of each kind of change."""
+    return {
+        "table": table,
+        "dry_run": dry_run,
+        "applied": not dry_run and not parse_errors and not plan["errors"],
+        "rows": row_count,
+        "inserted": len(plan["insert"]),
+        "updated": len(plan["update"]),
+        "deleted": len(plan["delete"]),
+        "unchanged": plan["unchanged"],
+        "errors": parse_errors + plan["errors"],
+        "sample": {
+            "insert": [[values[name] for name in NATURAL_KEY] for values in plan["insert"][:REPORT_SAMPLE_SIZE]],
+            "update": [
+                {"id": values["id"], "key": [values[name] for name in NATURAL_KEY], "changed": values["changed"]}
+                for values in plan["update"][:REPORT_SAMPLE_SIZE]
+            ],
+            "delete": [
+                {"id": values["id"], "key": [values[name] for name in NATURAL_KEY]}
+                for values in plan["delete"][:REPORT_SAMPLE_SIZE]
+            ],
+        },
+    }
+
+def run_import(table, data: bytes, import_format, dry_run=False, delete_missing=False):
+    """
+    Import a CSV or NDJSON file of listings into deals or demos.
+
+    The file is validated and diffed against the table by natural key
+    (year, make, model, term). Unless dry_run is set or the file has
+    errors, the inserts, updates and (with delete_missing) deletes are
+    applied in one transaction. Blocking; call it from a thread pool
+    inside async handlers.
+
+    Returns:
+        dict: Import report (see import_report)
+    """
+    model = IMPORT_TABLES[table]
+    rows, parse_errors = parse_rows(data, import_format)
+    db = SessionLocal()
+    try:
+        plan = plan_import(db, model, rows, delete_missing)
+        report = import_report(table, plan, parse_errors, dry_run, len(rows) + len(parse_errors))
+        if report["applied"]:
+            apply_import(db, model, plan)
+            db.commit()
+        return report
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,372 @@
+import asyncio
+import datetime
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+import sendgrid
+from sendgrid.helpers.mail import Mail, Email, To, Content
+from sqlalchemy import func, insert, select, update
+
+from database import AsyncSessionLocal, EmailOutbox, env_flag
+from metrics import sendgrid_send_seconds
+
+class SendGridTransport:
+    """Sends mail through one long-lived SendGrid client."""
+
+    def __init__(self, api_key, from_email, to_email):
+        self.client = sendgrid.SendGridAPIClient(api_key=api_key)
+        self.from_email = from_email
+        self.to_email = to_email
+        self.missing_settings = [
+            name for name, value in (
+                ("SENDGRID_API_KEY", api_key), ("SENDGRID_FROM_EMAIL", from_email), ("RECEIVER_EMAIL", to_email)
+            ) if not value
+        ]
+
+    def send(self, subject, body):
+        """Send a plain-text email, raising if SendGrid isn't configured or doesn't accept it."""
+        if self.missing_settings:
+            # Raising leaves the message to the outbox's retries, and then
+            # marks it failed, rather than dropping it
+            raise RuntimeError(f"SendGrid is not configured: set {', '.join(self.missing_settings)}")
+        mail = Mail(Email(self.from_email), To(self.to_email), subject, Content("text/plain", body))
+        with sendgrid_send_seconds.time():
+            response = self.client.send(mail)
+            if response.status_code != 202:
+                raise RuntimeError(f"SendGrid returned status code {response.status_code}")
+
+class LocalTransport:
+    """Stand-in transport that keeps messages in memory, for tests and local development."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, subject, body):
+        """Record the email instead of sending it."""
+        self.sent.append((subject, body))
+        print(f"Local email transport: {subject}")
+
+def transport_from_env():
+    """
+    Pick the mail transport from EMAIL_TRANSPORT ("sendgrid", the default, or "local").
+
+    The local stand-in is only used when asked for, so a deployment
+    missing its SendGrid settings fails to send instead of printing
+    notifications and marking them sent.
+    """
+    if os.getenv("EMAIL_TRANSPORT", "sendgrid").lower() == "local":
+        return LocalTransport()
+    transport = SendGridTransport(
+        os.getenv("SENDGRID_API_KEY"),
+        os.getenv("SENDGRID_FROM_EMAIL"),
+        os.getenv("RECEIVER_EMAIL"),
+    )
+    if transport.missing_settings:
+        print(f"Warning: {', '.join(transport.missing_settings)} not set. Emails will fail until they are; set EMAIL_TRANSPORT=local for development.")
+    return transport
+
+class DigestPolicy:
+    """
+    Decides which notifications are buffered into digest emails.
+
+    Buffered messages wait in the outbox with status "digest" until the
+    oldest is window_seconds old or max_items are waiting, and are then
+    combined into one summary email. Kinds listed in immediate_kinds are
+    always sent on their own.
+    """
+
+    def __init__(self, enabled=False, window_seconds=300, max_items=50, immediate_kinds=()):
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.max_items = max_items
+        self.immediate_kinds = {kind.strip().lower() for kind in immediate_kinds if kind.strip()}
+
+    def buffers(self, kind):
+        """Whether a notification of this kind waits for the next digest."""
+        return self.enabled and kind.lower() not in self.immediate_kinds
+
+digest_policy = DigestPolicy(
+    enabled=env_flag("EMAIL_DIGEST_MODE", "false"),
+    window_seconds=float(os.getenv("EMAIL_DIGEST_WINDOW_SECONDS", "300")),
+    max_items=int(os.getenv("EMAIL_DIGEST_MAX_ITEMS", "50")),
+    immediate_kinds=os.getenv("EMAIL_DIGEST_IMMEDIATE_TYPES", "").split(","),
+)
+
+def outbox_values(kind, subject, body, reference=None):
+    """Column values for an outbox row, to be inserted with the submission it reports."""
+    return {
+        "kind": kind,
+        "reference": reference,
+        "subject": subject,
+        "body": body,
+        "status": "digest" if digest_policy.buffers(kind) else "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.datetime.utcnow(),
+    }
+
+def build_digest_email(messages):
+    """
+    Combine buffered notifications into one summary email.
+
+    Leads are grouped by kind (form type or inquiry type) and, within a
+    kind, by what they are about (e.g. "deal:12"), followed by the full
+    text of every notification.
+
+    Args:
+        messages: Outbox rows with kind, reference, subject and body
+
+    Returns:
+        tuple: (subject, body)
+    """
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.kind, {}).setdefault(message.reference, []).append(message)
+
+    subject = f"Lead digest - {len(messages)} new submission{'s' if len(messages) != 1 else ''}"
+    lines = ["Summary:", "--------"]
+    for kind, references in sorted(groups.items()):
+        lines.append(f"{kind.title()}: {sum(len(group) for group in references.values())}")
+        for reference, group in sorted(references.items(), key=lambda item: item[0] or ""):
+            if reference is not None:
+                lines.append(f"    {reference}: {len(group)}")
+    lines += ["", "Details:", "--------"]
+    for kind, references in sorted(groups.items()):
+        for reference, group in sorted(references.items(), key=lambda item: item[0] or ""):
+            for message in group:
+                lines += [message.subject, message.body.strip("\n"), ""]
+    return subject, "\n".join(lines)
+
+class OutboxWorker:
+    """
+    Drains the email outbox in the background.
+
+    Messages are claimed by pushing their next_attempt_at forward by a
+    lease, so several workers (or a worker restarted mid-send) never send
+    the same message twice while the lease holds. Sends run on a bounded
+    thread pool that shares one transport. Failures are retried with
+    exponential backoff until max_attempts is reached.
+    """
+
+    def __init__(self, session_factory, transport, concurrency=4, batch_size=20, poll_interval=5.0,
+                 max_attempts=8, retry_base_seconds=30, retry_max_seconds=3600, lease_seconds=300,
+                 digest=None):
+        self.session_factory = session_factory
+        self.transport = transport
+        self.digest = digest or DigestPolicy()
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.lease_seconds = lease_seconds
+        self._executor = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.in_flight = 0
+        self.sent = 0
+        self.failed_attempts = 0
+        self.gave_up = 0
+        self.digests = 0
+        self.digested_messages = 0
+
+    async def start(self):
+        """Start draining the outbox."""
+        if self._task is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbox")
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Finish the current batch and stop."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+
+    def notify(self):
+        """Wake the worker after new messages were committed, instead of waiting for the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self._compact_digests()
+                messages = await self._claim()
+            except Exception as e:
+                print(f"Error claiming outbox messages: {e}")
+                messages = []
+            if messages:
+                await asyncio.gather(*[self._deliver(message) for message in messages])
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _claim(self):
+        """Claim up to batch_size due messages, including ones whose lease expired."""
+        now = datetime.datetime.utcnow()
+        lease_until = now + datetime.timedelta(seconds=self.lease_seconds)
+        async with self.session_factory() as db:
+            candidates = (await db.execute(
+                select(EmailOutbox.id, EmailOutbox.subject, EmailOutbox.body, EmailOutbox.attempts)
+                .where(EmailOutbox.status.in_(("pending", "sending")), EmailOutbox.next_attempt_at <= now)
+                .order_by(EmailOutbox.next_attempt_at)
+                .limit(self.batch_size)
+            )).all()
+            claimed = []
+            for candidate in candidates:
+                result = await db.execute(
+                    update(EmailOutbox)
+                    .where(
+                        EmailOutbox.id == candidate.id,
+                        EmailOutbox.status.in_(("pending", "sending")),
+                        EmailOutbox.next_attempt_at <= now,
+                    )
+                    .values(status="sending", next_attempt_at=lease_until)
+                )
+                if result.rowcount == 1:
+                    claimed.append(candidate)
+            await db.commit()
+        return claimed
+
+    async def _compact_digests(self):
+        """
+        Turn buffered notifications into digest emails once a digest is due.
+
+        Each digest is inserted as an ordinary pending outbox row in the
+        same transaction that marks its messages "digested", so it gets the
+        same retries as any other email and no lead is dropped or sent twice.
+        """
+        while True:
+            async with self.session_factory() as db:
+                count, oldest = (await db.execute(
+                    select(func.count(EmailOutbox.id), func.min(EmailOutbox.created_at))
+                    .where(EmailOutbox.status == "digest")
+                )).one()
+                if not count:
+                    return
+                window_start = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.digest.window_seconds)
+                if count < self.digest.max_items and oldest > window_start:
+                    return
+                messages = (await db.execute(
+                    select(EmailOutbox.id, EmailOutbox.kind, EmailOutbox.reference, EmailOutbox.subject, EmailOutbox.body)
+                    .where(EmailOutbox.status == "digest")
+                    .order_by(EmailOutbox.created_at, EmailOutbox.id)
+                    .limit(self.digest.max_items)
+                )).all()
+                result = await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_([message.id for message in messages]), EmailOutbox.status == "digest")
+                    .values(status="digested")
+                )
+                if result.rowcount != len(messages):
+                    # Another worker compacted some of these first; try again
+                    await db.rollback()
+                    continue
+                subject, body = build_digest_email(messages)
+                await db.execute(insert(EmailOutbox).values(outbox_values("digest", subject, body) | {"status": "pending"}))
+                await db.commit()
+            self.digests += 1
+            self.digested_messages += len(messages)
+
+    async def _deliver(self, message):
+        """Send one claimed message and record the outcome, never raising so the worker keeps running."""
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            await loop.run_in_executor(self._executor, self.transport.send, message.subject, message.body)
+        except Exception as e:
+            self.in_flight -= 1
+            try:
+                await self._record_failure(message, e)
+            except Exception as record_error:
+                # The lease expires and the message is retried
+                print(f"Error recording failure of outbox message {message.id}: {record_error}")
+            return
+        self.in_flight -= 1
+        self.sent += 1
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id == message.id)
+                    .values(status="sent", attempts=message.attempts + 1, sent_at=datetime.datetime.utcnow(), last_error=None)
+                )
+                await db.commit()
+        except Exception as e:
+            # Once its lease expires the message will be sent again
+            print(f"Error marking outbox message {message.id} as sent: {e}")
+
+    async def _record_failure(self, message, error):
+        attempts = message.attempts + 1
+        self.failed_attempts += 1
+        if attempts >= self.max_attempts:
+            self.gave_up += 1
+            status, next_attempt_at = "failed", None
+            print(f"Giving up on outbox message {message.id} after {attempts} attempts: {error}")
+        else:
+            # Exponential backoff with jitter so retries from a burst spread out
+            delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            status = "pending"
+            next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+            print(f"Error sending outbox message {message.id} (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+        async with self.session_factory() as db:
+            await db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id == message.id)
+                .values(status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=str(error))
+            )
+            await db.commit()
+
+    def stats(self):
+        """Return delivery counters."""
+        return {
+            "running": self._task is not None,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "failed_attempts": self.failed_attempts,
+            "gave_up": self.gave_up,
+            "digest_mode": self.digest.enabled,
+            "digests": self.digests,
+            "digested_messages": self.digested_messages,
+        }
+
+outbox_worker = OutboxWorker(
+    AsyncSessionLocal,
+    transport_from_env(),
+    concurrency=int(os.getenv("EMAIL_OUTBOX_CONCURRENCY", "4")),
+    poll_interval=float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5")),
+    max_attempts=int(os.getenv("EMAIL_MAX_ATTEMPTS", "8")),
+    retry_base_seconds=float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30")),
+    digest=digest_policy,
+)
+
+# Whether the web process drains the outbox itself; set to false when
+# running `python email_outbox.py` as a separate worker instead
+OUTBOX_WORKER_IN_WEB = env_flag("EMAIL_OUTBOX_WORKER_IN_WEB", "true")
+
+async def run_forever():
+    """Run the outbox worker until interrupted."""
+    await outbox_worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await outbox_worker.stop()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,21 @@
+import argparse
+import datetime
+
+from exports import EXPORT_FORMATS, EXPORT_TABLES, export_filename, export_stream
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export form submissions or vehicle inquiries as CSV or NDJSON.")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--format", dest="export_format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, help="only rows created at or after this ISO time")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, help="only rows created before this ISO time")
+    parser.add_argument("-o", "--output", help="output file (default: <table>.<format>[.gz])")
+    args = parser.parse_args()
+
+    output_path = args.output or export_filename(args.table, args.export_format, args.gzip)
+    chunks = export_stream(args.table, args.export_format, args.gzip, args.since, args.until)
+    with open(output_path, "wb") as output:
+        for chunk in chunks:
+            output.write(chunk)
+    print(f"Wrote {args.table} export to {output_path}")
@@ -0,0 +1,104 @@
+import csv
+import io
+import zlib
+from pydantic_core import to_json
+from sqlalchemy import select
+
+from database import (
+    SessionLocal, LeaseFormSubmission, SellFormSubmission, ConsultationFormSubmission,
+    DealInquirySubmission, DemoInquirySubmission,
+)
+
+# Export name -> model
+EXPORT_TABLES = {
+    "lease_submissions": LeaseFormSubmission,
+    "sell_submissions": SellFormSubmission,
+    "consultation_submissions": ConsultationFormSubmission,
+    "deal_inquiries": DealInquirySubmission,
+    "demo_inquiries": DemoInquirySubmission,
+}
+
+# Export format -> media type
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Rows fetched from the server-side cursor per round trip
+BATCH_SIZE = 1000
+
+def iter_row_batches(model, created_after=None, created_before=None):
+    """
+    Yield a table's rows in batches from a server-side cursor.
+
+    Selects plain column tuples rather than ORM objects so nothing
+    accumulates in a session identity map, and opens its own session
+    because the response keeps streaming after the request's
+    dependencies have been closed.
+    """
+    statement = select(*model.__table__.columns)
+    if created_after is not None:
+        statement = statement.where(model.created_at >= created_after)
+    if created_before is not None:
+        statement = statement.where(model.created_at < created_before)
+    statement = statement.order_by(model.created_at, model.id)
+
+    db = SessionLocal()
+    try:
+        result = db.execute(statement.execution_options(stream_results=True, yield_per=BATCH_SIZE))
+        for batch in result.partitions():
+            yield batch
+    finally:
+        db.close()
+
+def encode_csv(columns, batches):
+    """Encode row batches as CSV with a header row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def encode_ndjson(columns, batches):
+    """Encode row batches as newline-delimited JSON objects."""
+    for batch in batches:
+        yield b"".join(to_json(dict(zip(columns, row))) + b"\n" for row in batch)
+
+def gzip_chunks(chunks):
+    """Compress a stream of byte chunks into a single gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(table, export_format="csv", gzip=False, created_after=None, created_before=None):
+    """
+    Stream an export of a submission or inquiry table.
+
+    Args:
+        table: Key of EXPORT_TABLES
+        export_format: "csv" or "ndjson"
+        gzip: Compress the output
+        created_after: Only include rows created at or after this time
+        created_before: Only include rows created before this time
+
+    Returns:
+        iterator: Encoded chunks of the export
+    """
+    model = EXPORT_TABLES[table]
+    columns = [column.name for column in model.__table__.columns]
+    batches = iter_row_batches(model, created_after, created_before)
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    chunks = encode(columns, batches)
+    return gzip_chunks(chunks) if gzip else chunks
+
+def export_filename(table, export_format="csv", gzip=False):
+    """Return the download filename for an export."""
+    return f"{table}.{export_format}" + (".gz" if gzip else "")
@@ -0,0 +1,124 @@
+import bisect
+import threading
+from collections import Counter, namedtuple
+from sqlalchemy import func, select
+
+from database import Deal, Demo, Tag
+
+# The parts of a listing that contribute to its facet counts
+FacetSnapshot = namedtuple("FacetSnapshot", ["make", "tags", "lease_price"])
+
+def _decrement(counter, keys):
+    """Decrement counts, dropping keys that reach zero."""
+    for key in keys:
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+def listing_facets(listing):
+    """Capture the facet-relevant fields of a Deal or Demo."""
+    return FacetSnapshot(listing.make, tuple(tag.name for tag in listing.tags), listing.lease_price)
+
+class FacetIndex:
+    """
+    Make and tag counts plus lease price bounds for one listing table.
+
+    Built from the database with aggregate queries on first use and then
+    kept current by the write endpoints through add/remove, so serving
+    the filter sidebar never needs the full catalog.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.loaded = False
+        self.total = 0
+        self.makes = Counter()
+        self.tags = Counter()
+        self._prices = []
+        self._lock = threading.Lock()
+        # Incremented on every write so a load racing a write can tell it missed one
+        self._generation = 0
+
+    async def load(self, db):
+        """Rebuild the index from the database unless it is already loaded."""
+        if self.loaded:
+            return
+        generation = self._generation
+        model = self.model
+        links = model.tags.property.secondary
+
+        total = (await db.execute(select(func.count(model.id)))).scalar_one()
+        makes = Counter(dict((await db.execute(select(model.make, func.count(model.id)).group_by(model.make))).all()))
+        tags = Counter(dict((await db.execute(
+            select(Tag.name, func.count(links.c.listing_id))
+            .join(links, links.c.tag_id == Tag.id)
+            .join(model, model.id == links.c.listing_id)
+            .group_by(Tag.name)
+        )).all()))
+        prices = list((await db.execute(
+            select(model.lease_price).where(model.lease_price.isnot(None)).order_by(model.lease_price)
+        )).scalars())
+
+        with self._lock:
+            # A write committed while we were reading; leave the index
+            # unloaded so the next request reads again
+            if generation != self._generation:
+                return
+            self.total, self.makes, self.tags, self._prices = total, makes, tags, prices
+            self.loaded = True
+
+    def add(self, snapshot):
+        """Count a newly created (or updated) listing."""
+        with self._lock:
+            self._generation += 1
+            if not self.loaded:
+                return
+            self.total += 1
+            self.makes[snapshot.make] += 1
+            self.tags.update(snapshot.tags)
+            if snapshot.lease_price is not None:
+                bisect.insort(self._prices, snapshot.lease_price)
+
+    def remove(self, snapshot):
+        """Stop counting a deleted (or about to be updated) listing."""
+        with self._lock:
+            self._generation += 1
+            if not self.loaded:
+                return
+            self.total -= 1
+            _decrement(self.makes, [snapshot.make])
+            _decrement(self.tags, snapshot.tags)
+            if snapshot.lease_price is not None:
+                position = bisect.bisect_left(self._prices, snapshot.lease_price)
+                if position < len(self._prices) and self._prices[position] == snapshot.lease_price:
+                    del self._prices[position]
+
+    def replace(self, before, after):
+        """Move a listing's counts from its old snapshot to its new one."""
+        self.remove(before)
+        self.add(after)
+
+    def invalidate(self):
+        """Drop the counts after a bulk change, so the next request rebuilds them."""
+        with self._lock:
+            self._generation += 1
+            self.loaded = False
+
+    def to_dict(self):
+        """Return the facets in the shape of FacetsResponse."""
+        with self._lock:
+            return {
+                "total": self.total,
+                "makes": [
+                    {"value": make, "count": count}
+                    for make, count in sorted(item for item in self.makes.items() if item[0] is not None)
+                ],
+                "tags": [{"value": tag, "count": count} for tag, count in sorted(self.tags.items())],
+                "lease_price": {
+                    "min": self._prices[0] if self._prices else None,
+                    "max": self._prices[-1] if self._prices else None,
+                },
+            }
+
+deal_facets = FacetIndex(Deal)
+demo_facets = FacetIndex(Demo)
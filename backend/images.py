@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+# Bump when VARIANTS or FORMATS change, so re-rendered images get new keys
+RENDER_VERSION = 2
+
+# Variant name -> largest width in pixels; images are never upscaled
+VARIANTS = {"card": 480, "detail": 1024, "full": 1920}
+
+# Encoded formats of every variant: extension -> (Pillow format, content type, save options)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# Key names in the srcset map returned with listings
+SRCSET_NAMES = {"webp": "webp", "jpg": "jpeg"}
+
+# Leading bytes of the image types accepted for upload
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# URL of an upload that has variants: .../<folder>/<upload id>/full-<width>.jpg
+VARIANT_URL_PATTERN = re.compile(r"^(?P<base>.+/[0-9a-f]{32})/full-(?P<width>[0-9]+)\.jpg$")
+
+# EXIF tag holding the camera's orientation
+ORIENTATION_TAG = 0x0112
+
+# Largest decoded image accepted, guarding against decompression bombs
+Image.MAX_IMAGE_PIXELS = 50_000_000
+
+def sniff_image_type(data):
+    """Return the content type of an image from its leading bytes, or None if it isn't a supported image."""
+    head = bytes(data[:12])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    return None
+
+def content_id(data):
+    """
+    Return the id under which an image's variants are stored.
+
+    It is derived from the image's bytes and RENDER_VERSION, so uploading
+    the same photo again maps to the variants that already exist.
+    """
+    digest = hashlib.sha256(b"v%d:" % RENDER_VERSION)
+    digest.update(data)
+    return digest.hexdigest()[:32]
+
+def source_width(data):
+    """Return an image's width once its EXIF orientation is applied, reading only its header."""
+    with Image.open(io.BytesIO(data)) as image:
+        # Orientations 5-8 rotate the image by 90 degrees
+        if image.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+            return image.height
+        return image.width
+
+def variant_widths(width):
+    """
+    Return the variants rendered for an image `width` pixels wide.
+
+    Images are never upscaled, so a variant at least as wide as the image
+    would be a copy of the full one and is left out. The full variant is
+    always rendered, and is only as wide as the image when that is
+    narrower than its limit. As the full width is therefore enough to
+    work out the others, it is part of the full variant's key.
+
+    Returns:
+        dict: variant -> rendered width, smallest first
+    """
+    *smaller, full = VARIANTS
+    widths = {variant: VARIANTS[variant] for variant in smaller if VARIANTS[variant] < width}
+    widths[full] = min(width, VARIANTS[full])
+    return widths
+
+def variant_key(folder, upload_id, variant, width, extension):
+    """Bucket key of one variant of an uploaded image."""
+    return f"{folder}/{upload_id}/{variant}-{width}.{extension}"
+
+def full_variant_key(folder, upload_id, width):
+    """Bucket key of the full JPEG of an image `width` pixels wide, the URL stored for it."""
+    widths = variant_widths(width)
+    return variant_key(folder, upload_id, "full", widths["full"], "jpg")
+
+def render_variants(data):
+    """
+    Resize and re-encode an image into every variant and format.
+
+    Runs in a worker process, so it only takes and returns plain bytes.
+
+    Returns:
+        dict: (variant, width, extension) -> encoded bytes
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        # Apply the camera's orientation before the EXIF data is dropped
+        image = ImageOps.exif_transpose(source).convert("RGBA")
+    # Flatten transparency onto white, since JPEG has no alpha channel
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    image = background
+    rendered = {}
+    for variant, width in variant_widths(image.width).items():
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for extension, (image_format, _, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            rendered[(variant, width, extension)] = buffer.getvalue()
+    return rendered
+
+_pool = None
+
+def get_pool():
+    """Return the process pool used for image encoding, starting it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "2")))
+    return _pool
+
+def shutdown_pool():
+    """Stop the image worker processes."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+async def generate_variants(data, folder, upload_id):
+    """
+    Render every variant of an uploaded image in the process pool.
+
+    The full JPEG comes last, so callers that upload in order can treat it
+    as the marker that all variants of upload_id are stored.
+
+    Returns:
+        list: (bucket key, encoded bytes, content type) for each variant
+    """
+    rendered = await asyncio.get_running_loop().run_in_executor(get_pool(), render_variants, bytes(data))
+    variants = sorted(rendered.items(), key=lambda item: (item[0][0], item[0][2]) == ("full", "jpg"))
+    return [
+        (variant_key(folder, upload_id, variant, width, extension), encoded, FORMATS[extension][1])
+        for (variant, width, extension), encoded in variants
+    ]
+
+def image_srcset(image_url):
+    """
+    Return srcset strings for the variants of an uploaded image.
+
+    Only images uploaded through the variant pipeline have variants;
+    anything else (older uploads, external URLs) gets None. Only the
+    variants that were rendered are listed, at their real widths, which
+    follow from the width in the full variant's key.
+
+    Returns:
+        dict or None: {"webp": srcset, "jpeg": srcset}
+    """
+    match = VARIANT_URL_PATTERN.match(image_url or "")
+    if match is None:
+        return None
+    base = match.group("base")
+    widths = variant_widths(int(match.group("width")))
+    return {
+        SRCSET_NAMES[extension]: ", ".join(f"{base}/{variant}-{width}.{extension} {width}w" for variant, width in widths.items())
+        for extension in FORMATS
+    }
@@ -0,0 +1,23 @@
+import argparse
+import json
+
+from catalog_import import IMPORT_FORMATS, IMPORT_TABLES, run_import
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk insert/update deals or demos from a CSV or NDJSON dealer feed.")
+    parser.add_argument("table", choices=sorted(IMPORT_TABLES))
+    parser.add_argument("file", help="CSV (with a header row) or NDJSON file")
+    parser.add_argument("--format", dest="import_format", choices=IMPORT_FORMATS, help="default: from the file extension")
+    parser.add_argument("--dry-run", action="store_true", help="report the changes without applying them")
+    parser.add_argument("--delete-missing", action="store_true", help="delete listings that are not in the file")
+    args = parser.parse_args()
+
+    import_format = args.import_format or ("ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "csv")
+    with open(args.file, "rb") as feed:
+        report = run_import(args.table, feed.read(), import_format, args.dry_run, args.delete_missing)
+    print(json.dumps(report, indent=2, default=str))
+    if report["applied"]:
+        # The API's catalog cache and facet counts live in its own process
+        print(f"Imported into {args.table}; restart the API (or import through POST /imports/{args.table}) to refresh its cached listings")
+    elif not args.dry_run:
+        print("Nothing was imported because of the errors above")
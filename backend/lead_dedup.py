@@ -0,0 +1,220 @@
+import datetime
+import hashlib
+import os
+import time
+from collections import Counter, OrderedDict
+from sqlalchemy import select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import AsyncSessionLocal, env_flag, LeadFingerprint
+
+LEAD_DEDUP_ENABLED = env_flag("LEAD_DEDUP_ENABLED", "true")
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+def normalize_phone(phone):
+    """Digits only, without a leading US country code."""
+    digits = "".join(character for character in (phone or "") if character.isdigit())
+    return digits[-10:] if len(digits) > 10 else digits
+
+def lead_fingerprints(kind, subject, email, phone):
+    """
+    Fingerprints identifying a lead: one for its email and one for its phone.
+
+    Args:
+        kind: Form type or "deal inquiry" / "demo inquiry"
+        subject: What the lead is about, e.g. "deal:12" or a VIN ("" if nothing)
+        email: Submitted email address
+        phone: Submitted phone number
+
+    Returns:
+        list: Hex digests; a repeat of either counts as a duplicate
+    """
+    fingerprints = []
+    for field, value in (("email", normalize_email(email)), ("phone", normalize_phone(phone))):
+        if value:
+            key = "\x1f".join((kind.lower(), (subject or "").lower(), field, value))
+            fingerprints.append(hashlib.sha256(key.encode()).hexdigest())
+    return fingerprints
+
+class LeadDeduplicator:
+    """
+    Suppresses repeat submissions of the same lead within a time window.
+
+    Recently seen fingerprints and when their window opened are kept in a
+    bounded LRU, so a burst of repeats (a double click, a bot) is
+    recognised without touching the database. On a miss, the
+    lead_fingerprints table confirms whether another process, or this
+    one before a restart, saw the lead. Suppressed repeats are counted in
+    memory and added to the table in one UPDATE per fingerprint every
+    flush_interval seconds.
+
+    Every query runs in its own short session, so a request holds no
+    connection while its lead waits in the write pipeline.
+    """
+
+    def __init__(self, session_factory, enabled=True, window_seconds=600, cache_size=10000, flush_interval=5.0):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.window = datetime.timedelta(seconds=window_seconds)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._recent = OrderedDict()
+        self._pending = Counter()
+        self._last_flush = time.monotonic()
+        self.checked = 0
+        self.duplicates = 0
+        self.cache_hits = 0
+        self.database_hits = 0
+
+    def _remember(self, fingerprint, window_started_at):
+        self._recent[fingerprint] = window_started_at
+        self._recent.move_to_end(fingerprint)
+        while len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+
+    def _cached(self, fingerprints, cutoff):
+        for fingerprint in fingerprints:
+            started = self._recent.get(fingerprint)
+            if started is not None and started >= cutoff:
+                self._recent.move_to_end(fingerprint)
+                return fingerprint
+        return None
+
+    async def is_duplicate(self, fingerprints):
+        """
+        Check whether a lead repeats one saved within the window, counting it if so.
+
+        A lead that isn't a duplicate has its fingerprints reserved in the
+        cache before this returns, so concurrent repeats (a double click, a
+        bot burst) are duplicates even before it is saved; call record()
+        once it is saved, or release() otherwise. Errors reading the
+        table are treated as "not a duplicate", so a lead is never lost to
+        the check itself.
+        """
+        if not self.enabled or not fingerprints:
+            return False
+        self.checked += 1
+        cutoff = datetime.datetime.utcnow() - self.window
+        match = self._cached(fingerprints, cutoff)
+        if match is not None:
+            self.cache_hits += 1
+        else:
+            try:
+                async with self.session_factory() as db:
+                    rows = (await db.execute(
+                        select(LeadFingerprint.fingerprint, LeadFingerprint.window_started_at)
+                        .where(LeadFingerprint.fingerprint.in_(fingerprints), LeadFingerprint.window_started_at >= cutoff)
+                    )).all()
+            except Exception as e:
+                print(f"Error checking lead fingerprints: {e}")
+                rows = []
+            for fingerprint, window_started_at in rows:
+                self._remember(fingerprint, window_started_at)
+                match = match or fingerprint
+            if match is not None:
+                self.database_hits += 1
+            else:
+                # A concurrent request for the same lead may have reserved it
+                # while the query was running; from here to the reservation
+                # there is no await
+                match = self._cached(fingerprints, cutoff)
+                if match is None:
+                    reserved_at = datetime.datetime.utcnow()
+                    for fingerprint in fingerprints:
+                        self._remember(fingerprint, reserved_at)
+                    return False
+                self.cache_hits += 1
+
+        self.duplicates += 1
+        self._pending[match] += 1
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+        return True
+
+    def release(self, fingerprints):
+        """Drop the reservation made by is_duplicate for a lead that couldn't be saved."""
+        for fingerprint in fingerprints:
+            self._recent.pop(fingerprint, None)
+
+    async def record(self, kind, fingerprints):
+        """Open a new window for the fingerprints of a lead that was just saved."""
+        if not self.enabled or not fingerprints:
+            return
+        now = datetime.datetime.utcnow()
+        rows = [
+            # Repeats suppressed while the lead was being saved had no row to update yet
+            {"fingerprint": fingerprint, "kind": kind, "window_started_at": now, "last_seen_at": now,
+             "duplicates": self._pending.pop(fingerprint, 0)}
+            for fingerprint in fingerprints
+        ]
+        table = LeadFingerprint.__table__
+        try:
+            async with self.session_factory() as db:
+                if db.get_bind().dialect.name == "mysql":
+                    statement = mysql_insert(table)
+                    statement = statement.on_duplicate_key_update(
+                        window_started_at=statement.inserted.window_started_at,
+                        last_seen_at=statement.inserted.last_seen_at,
+                        duplicates=table.c.duplicates + statement.inserted.duplicates,
+                    )
+                else:
+                    statement = sqlite_insert(table)
+                    statement = statement.on_conflict_do_update(
+                        index_elements=["fingerprint"],
+                        set_={
+                            "window_started_at": statement.excluded.window_started_at,
+                            "last_seen_at": statement.excluded.last_seen_at,
+                            "duplicates": table.c.duplicates + statement.excluded.duplicates,
+                        },
+                    )
+                await db.execute(statement, rows)
+                await db.commit()
+        except Exception as e:
+            print(f"Error recording lead fingerprints: {e}")
+            return
+        for fingerprint in fingerprints:
+            self._remember(fingerprint, now)
+
+    async def flush(self):
+        """Add the suppressed repeats counted in memory to lead_fingerprints."""
+        pending, self._pending = self._pending, Counter()
+        self._last_flush = time.monotonic()
+        if not pending:
+            return
+        now = datetime.datetime.utcnow()
+        try:
+            async with self.session_factory() as db:
+                for fingerprint, count in pending.items():
+                    await db.execute(
+                        update(LeadFingerprint)
+                        .where(LeadFingerprint.fingerprint == fingerprint)
+                        .values(duplicates=LeadFingerprint.duplicates + count, last_seen_at=now)
+                    )
+                await db.commit()
+        except Exception as e:
+            print(f"Error flushing lead duplicate counts: {e}")
+            # Keep the counts for the next flush
+            self._pending.update(pending)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "window_seconds": self.window.total_seconds(),
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "cache_hits": self.cache_hits,
+            "database_hits": self.database_hits,
+            "cached_fingerprints": len(self._recent),
+            "pending_counts": sum(self._pending.values()),
+        }
+
+lead_deduplicator = LeadDeduplicator(
+    AsyncSessionLocal,
+    enabled=LEAD_DEDUP_ENABLED,
+    window_seconds=float(os.getenv("LEAD_DEDUP_WINDOW_SECONDS", "600")),
+    cache_size=int(os.getenv("LEAD_DEDUP_CACHE_SIZE", "10000")),
+    flush_interval=float(os.getenv("LEAD_DEDUP_FLUSH_SECONDS", "5")),
+)
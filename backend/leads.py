@@ -0,0 +1,60 @@
+import datetime
+from typing import Optional
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pagination import decode_cursor, fetch_page, keyset_after
+
+# Page size used when the client doesn't ask for one
+DEFAULT_PAGE_SIZE = 100
+
+# Largest page a client can request from the admin listings
+MAX_PAGE_SIZE = 1000
+
+class LeadQuery(BaseModel):
+    """Query parameters accepted by the admin submission and inquiry listings."""
+    created_after: Optional[datetime.datetime] = None
+    created_before: Optional[datetime.datetime] = None
+    email: Optional[str] = None
+    limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+
+class DealInquiryQuery(LeadQuery):
+    deal_id: Optional[int] = None
+
+class DemoInquiryQuery(LeadQuery):
+    demo_id: Optional[int] = None
+
+def filter_leads(query, model, params: LeadQuery):
+    """Apply the date-range, email and listing id filters of a LeadQuery."""
+    if params.created_after is not None:
+        query = query.where(model.created_at >= params.created_after)
+    if params.created_before is not None:
+        query = query.where(model.created_at < params.created_before)
+    if params.email:
+        query = query.where(model.email == params.email)
+    for column_name in ("deal_id", "demo_id"):
+        value = getattr(params, column_name, None)
+        if value is not None:
+            query = query.where(getattr(model, column_name) == value)
+    return query
+
+async def query_leads(db: AsyncSession, model, params: LeadQuery):
+    """
+    Return one page of submissions, newest first.
+
+    Pages are keyed on (created_at, id), which the composite indexes on
+    every lead table answer with a range scan, so deep pages cost the
+    same as the first one.
+
+    Returns:
+        tuple: (list of rows, cursor for the next page or None)
+    """
+    sort_columns = [model.created_at, model.id]
+    query = filter_leads(select(model), model, params)
+    if params.cursor:
+        values = decode_cursor(params.cursor, [datetime.datetime, int])
+        query = query.where(keyset_after(sort_columns, values, descending=True))
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    return await fetch_page(db, query, sort_columns, params.limit)
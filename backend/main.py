@@ -1,18 +1,41 @@
 # import uvicorn
+import asyncio
 import os
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Depends, UploadFile, File, Form
-from pydantic import BaseModel
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict
+from pydantic_core import to_json
 from fastapi.middleware.cors import CORSMiddleware
-import sendgrid
-from sendgrid.helpers.mail import Mail, Email, To, Content
 from dotenv import load_dotenv
-from typing import Optional, List
-from sqlalchemy.orm import Session
+from typing import Annotated, Literal, Optional, List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from botocore.exceptions import BotoCoreError, ClientError
 import datetime
 
 # Import database modules
-from database import get_db, init_db, LeaseFormSubmission, SellFormSubmission, ConsultationFormSubmission, Deal, Demo, DealInquirySubmission, DemoInquirySubmission
-from s3_utils import upload_file_to_s3
+from database import env_flag, get_db, init_db, async_engine, pool_options, sync_pool_stats, async_pool_stats, split_tags, get_or_create_tags, deal_score, LeaseFormSubmission, SellFormSubmission, ConsultationFormSubmission, Listing, Deal, Demo, DealInquirySubmission, DemoInquirySubmission, EmailOutbox
+from s3_utils import delete_object, download_bytes, object_exists, public_url, upload_bytes_to_s3
+from images import content_id, full_variant_key, generate_variants, image_srcset, shutdown_pool as shutdown_image_pool, sniff_image_type, source_width
+from uploads import IMAGE_UPLOAD_OPENAPI, CompleteUploadRequest, PresignUploadRequest, check_uploaded_object, presign_upload, receive_image, verify_image_url
+from catalog import ListingFilters, ListingQuery, query_listings, query_listings_by_type
+from catalog_cache import catalog_cache, etag_matches
+from facets import deal_facets, demo_facets, listing_facets
+from exports import EXPORT_FORMATS, EXPORT_TABLES, export_filename, export_stream
+from catalog_import import IMPORT_TABLES, run_import
+from search import MAX_SUGGESTIONS, SearchQuery, listing_search
+from quotes import QuoteQuery, quote_book, quote_catalog
+from write_pipeline import write_pipeline
+from analytics import ROLLUP_COMPACTOR_IN_WEB, InquiryRankingQuery, InquirySeriesQuery, SubmissionRollupQuery, inquiry_ranking, inquiry_series, rollup_compactor, submission_rollup
+from lead_dedup import lead_deduplicator, lead_fingerprints
+from email_outbox import OUTBOX_WORKER_IN_WEB, outbox_values, outbox_worker
+from leads import LeadQuery, DealInquiryQuery, DemoInquiryQuery, query_leads
+from pagination import NEXT_CURSOR_HEADER
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry as metrics_registry
+from profiling import PROFILING_ENABLED, ProfilingMiddleware, profiler
+from rate_limit import RATE_LIMIT_ENABLED, RateLimitMiddleware, rate_limiter
+from serializers import RowSerializer, json_response
 
 load_dotenv()
 
@@ -22,6 +45,20 @@ app = FastAPI()
 @app.on_event("startup")
 async def startup_db_client():
     init_db()
+    await write_pipeline.start()
+    if OUTBOX_WORKER_IN_WEB:
+        await outbox_worker.start()
+    if ROLLUP_COMPACTOR_IN_WEB:
+        await rollup_compactor.start()
+
+@app.on_event("shutdown")
+async def shutdown_db_client():
+    await write_pipeline.stop()
+    await outbox_worker.stop()
+    await rollup_compactor.stop()
+    await lead_deduplicator.flush()
+    shutdown_image_pool()
+    await async_engine.dispose()
 
 origins = [
     'http://localhost:3000',
@@ -32,14 +69,37 @@ origins = [
     'https://api.cardealbroker.com',
     'https://8jjm75j2.up.railway.app',
     ]
+# Added before CORS so that CORSMiddleware wraps it and 429s carry CORS headers
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins = origins,
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+# Outermost, so latency includes the other middleware and rate-limited requests are counted
+if env_flag("METRICS_ENABLED", "true"):
+    app.add_middleware(MetricsMiddleware)
+
+# Not installed at all unless enabled, so it costs nothing otherwise
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+metrics_registry.gauge(
+    "db_pool_checked_out", "Connections currently checked out of each pool.",
+    lambda: {("sync",): sync_pool_stats.snapshot().get("checked_out", 0), ("async",): async_pool_stats.snapshot().get("checked_out", 0)},
+    ("engine",),
+)
+metrics_registry.gauge("write_pipeline_queue_depth", "Rows waiting for a group commit.", lambda: write_pipeline.stats()["queue_depth"])
+metrics_registry.gauge("email_outbox_in_flight", "Outbox emails being sent right now.", lambda: outbox_worker.in_flight)
+metrics_registry.gauge("lead_dedup_pending_counts", "Suppressed duplicate leads not yet written to the database.", lambda: lead_deduplicator.stats()["pending_counts"])
+metrics_registry.gauge("rate_limit_buckets", "Clients with a rate limit bucket in this process.", lambda: rate_limiter.store.stats().get("keys", 0))
+
 # Admin authentication endpoint
 class AdminLoginRequest(BaseModel):
     password: str
@@ -118,9 +178,8 @@ class LeaseFormResponse(BaseModel):
     zip_code: str
     miles_per_year: str
     credit_score: str
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class SellFormResponse(BaseModel):
     id: int
@@ -134,9 +193,8 @@ class SellFormResponse(BaseModel):
     condition: str
     two_keys: bool
     major_damage: bool
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class ConsultationFormResponse(BaseModel):
     id: int
@@ -145,12 +203,13 @@ class ConsultationFormResponse(BaseModel):
     email: str
     phone_number: str
     zip_code: str
-    
-    class Config:
-        orm_mode = True
 
-class DealResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+class ListingResponse(BaseModel):
+    """A deal or demo; both are rows of the listings table."""
     id: int
+    listing_type: str
     make: str
     model: str
     year: int
@@ -163,27 +222,49 @@ class DealResponse(BaseModel):
     savings: Optional[float] = None
     tags: Optional[list[str]] = None
     description: Optional[str] = None
-    
-    class Config:
-        orm_mode = True
+    image_srcset: Optional[dict[str, str]] = None
+    deal_score: Optional[float] = None
 
-class DemoResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class PriceBounds(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class FacetsResponse(BaseModel):
+    total: int
+    makes: List[FacetCount]
+    tags: List[FacetCount]
+    lease_price: PriceBounds
+
+class ListingPage(BaseModel):
+    items: List[ListingResponse]
+    next_cursor: Optional[str] = None
+    facets: FacetsResponse
+
+class ListingsResponse(BaseModel):
+    deals: ListingPage
+    demos: ListingPage
+
+class SuggestionResponse(BaseModel):
+    value: str
+    kind: str
+    count: int
+
+class QuoteResponse(BaseModel):
     id: int
+    listing_type: str
+    year: int
     make: str
     model: str
-    year: int
     image_url: str
     lease_price: float
-    term: int
-    down_payment: float
-    mileage: int
-    msrp: float
-    savings: Optional[float] = None
-    tags: Optional[list[str]] = None
-    description: Optional[str] = None
-    
-    class Config:
-        orm_mode = True
+    monthly_payment: float
+    total_cost: float
 
 class DealInquiryResponse(BaseModel):
     id: int
@@ -202,9 +283,8 @@ class DealInquiryResponse(BaseModel):
     mileage: int
     msrp: float
     savings: Optional[float] = None
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class DemoInquiryResponse(BaseModel):
     id: int
@@ -223,14 +303,28 @@ class DemoInquiryResponse(BaseModel):
     mileage: int
     msrp: float
     savings: Optional[float] = None
-    
-    class Config:
-        orm_mode = True
 
-def send_email_sendgrid(email_data: EmailRequest):
-    sg = sendgrid.SendGridAPIClient(api_key=os.getenv("SENDGRID_API_KEY"))
-    from_email = Email(os.getenv("SENDGRID_FROM_EMAIL"))
-    to_email = To(os.getenv("RECEIVER_EMAIL")) 
+    model_config = ConfigDict(from_attributes=True)
+
+def tag_names(listing):
+    """Return the names of a listing's tags."""
+    return [tag.name for tag in listing.tags]
+
+def listing_srcset(listing):
+    """Return the srcset map of a listing's image variants, if it has any."""
+    return image_srcset(listing.image_url)
+
+# Precompiled serializers for the list endpoints, which return JSON bytes
+# directly instead of re-validating every row against response_model
+lease_serializer = RowSerializer(LeaseFormResponse)
+sell_serializer = RowSerializer(SellFormResponse)
+consultation_serializer = RowSerializer(ConsultationFormResponse)
+listing_serializer = RowSerializer(ListingResponse, computed={"tags": tag_names, "image_srcset": listing_srcset})
+deal_inquiry_serializer = RowSerializer(DealInquiryResponse)
+demo_inquiry_serializer = RowSerializer(DemoInquiryResponse)
+
+def build_form_email(email_data: EmailRequest):
+    """Return the (subject, body) of the notification for a form submission."""
     subject = f"New {email_data.formType} Submission - {email_data.firstName} {email_data.lastName}"
     
     email_body = f"""
@@ -276,27 +370,43 @@ def send_email_sendgrid(email_data: EmailRequest):
     Zip Code: {email_data.zipCode}
     """
     
-    content = Content("text/plain", email_body)
-
-    mail = Mail(from_email, to_email, subject, content)
+    return subject, email_body
 
+def send_email_now(subject, body):
+    """Send a notification directly, for submissions that couldn't be written to the outbox."""
     try:
-        response = sg.send(mail)
-        if response.status_code == 202:
-            print(f"Email sent successfully with status code {response.status_code}")
-            return True
-        else:
-            print(f"Failed to send email with status code {response.status_code}")
-            return False
+        outbox_worker.transport.send(subject, body)
+        print("Email sent successfully")
+        return True
     except Exception as e:
         print(f"Error sending email: {e}")
         return False
 
+async def write_rows(db: AsyncSession, rows):
+    """Insert rows in one transaction, through the group-commit pipeline when it is enabled."""
+    if write_pipeline.enabled:
+        await write_pipeline.submit(rows)
+    else:
+        db.add_all([model(**values) for model, values in rows])
+        await db.commit()
+
+def form_fingerprints(email_data: EmailRequest):
+    """Duplicate-detection fingerprints of a form submission: what it is about, by email and by phone."""
+    form_type = email_data.formType.lower()
+    if form_type == "lease form":
+        subject = f"{email_data.vehicleMake}:{email_data.vehicleModel}"
+    elif form_type == "sell form":
+        subject = email_data.vin
+    else:
+        subject = ""
+    return lead_fingerprints(form_type, subject, email_data.email, email_data.phoneNumber)
+
 # Save form data to database
-def save_form_to_db(email_data: EmailRequest, db: Session):
+async def save_form_to_db(email_data: EmailRequest, db: AsyncSession):
     try:
         if email_data.formType.lower() == "lease form":
-            db_submission = LeaseFormSubmission(
+            submission_model = LeaseFormSubmission
+            values = dict(
                 first_name=email_data.firstName,
                 last_name=email_data.lastName,
                 email=email_data.email,
@@ -308,7 +418,8 @@ def save_form_to_db(email_data: EmailRequest, db: Session):
                 credit_score=email_data.creditScore
             )
         elif email_data.formType.lower() == "sell form":
-            db_submission = SellFormSubmission(
+            submission_model = SellFormSubmission
+            values = dict(
                 first_name=email_data.firstName,
                 last_name=email_data.lastName,
                 email=email_data.email,
@@ -321,7 +432,8 @@ def save_form_to_db(email_data: EmailRequest, db: Session):
                 major_damage=email_data.majorDamage if email_data.majorDamage is not None else False
             )
         elif email_data.formType.lower() == "consultation form":
-            db_submission = ConsultationFormSubmission(
+            submission_model = ConsultationFormSubmission
+            values = dict(
                 first_name=email_data.firstName,
                 last_name=email_data.lastName,
                 email=email_data.email,
@@ -331,31 +443,105 @@ def save_form_to_db(email_data: EmailRequest, db: Session):
         else:
             return False
             
-        db.add(db_submission)
-        db.commit()
-        db.refresh(db_submission)
+        subject, body = build_form_email(email_data)
+        notification = outbox_values(email_data.formType.lower(), subject, body)
+        await write_rows(db, [(submission_model, values), (EmailOutbox, notification)])
         return True
     except Exception as e:
         print(f"Error saving to database: {e}")
-        db.rollback()
+        await db.rollback()
         return False
 
 @app.get("/")
 async def root():
     return {"message": "CarDealBroker API is running", "cors_origins": origins}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Report request, database, S3, SendGrid and queue metrics in the Prometheus text format."""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/internal/pool_stats", response_model=dict)
+async def get_pool_stats():
+    """Report connection pool settings, occupancy and checkout latency."""
+    return {
+        "settings": pool_options,
+        "sync": sync_pool_stats.snapshot(),
+        "async": async_pool_stats.snapshot(),
+    }
+
+@app.get("/internal/write_pipeline_stats", response_model=dict)
+async def get_write_pipeline_stats():
+    """Report group-commit flush sizes, latency and queue depth."""
+    return write_pipeline.stats()
+
+@app.get("/internal/email_outbox_stats", response_model=dict)
+async def get_email_outbox_stats():
+    """Report email outbox delivery counters."""
+    return outbox_worker.stats()
+
+@app.get("/internal/profiles", response_model=dict)
+async def get_profiles():
+    """List this worker's recent request profiles, newest first."""
+    return {"enabled": PROFILING_ENABLED, "directory": profiler.directory, "profiles": list(profiler.recent)}
+
+@app.get("/internal/profiles/{filename}")
+async def get_profile_file(filename: str):
+    """Download a profile file listed by /internal/profiles (open .speedscope.json files in speedscope)."""
+    path = profiler.path(filename)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path)
+
+@app.get("/internal/rate_limit_stats", response_model=dict)
+async def get_rate_limit_stats():
+    """Report rate limiter counters and bucket store size."""
+    return rate_limiter.stats()
+
+@app.get("/internal/lead_dedup_stats", response_model=dict)
+async def get_lead_dedup_stats():
+    """Report duplicate lead suppression counters."""
+    return lead_deduplicator.stats()
+
+@app.get("/internal/analytics_rollup_stats", response_model=dict)
+async def get_analytics_rollup_stats():
+    """Report lead rollup compaction counters."""
+    return rollup_compactor.stats()
+
 @app.post("/submit_form/", response_model=SuccessResponse, responses={
     200: {"model": SuccessResponse},
     400: {"model": ErrorResponse},
     500: {"model": ErrorResponse}
 })
-async def submit_form(email_data: EmailRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def submit_form(email_data: EmailRequest, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
     try:
-        # Save to database
-        db_success = save_form_to_db(email_data, db)
-        
-        # Send email
-        background_tasks.add_task(send_email_sendgrid, email_data)
+        # A repeat of a lead saved within the dedup window is only counted:
+        # no second row, no second email
+        fingerprints = form_fingerprints(email_data)
+        if await lead_deduplicator.is_duplicate(fingerprints):
+            return SuccessResponse(
+                message="Form submitted successfully. Data saved and email is being sent.",
+                data={"formType": email_data.formType, "database_saved": True, "duplicate": True}
+            )
+
+        # The reservation made by is_duplicate is dropped unless the lead is
+        # recorded, including when saving raises or the request is cancelled
+        recorded = False
+        try:
+            # Save to database
+            db_success = await save_form_to_db(email_data, db)
+
+            # The notification was queued in the outbox with the submission; if
+            # that failed, fall back to sending it straight away
+            if db_success:
+                outbox_worker.notify()
+                await lead_deduplicator.record(email_data.formType.lower(), fingerprints)
+                recorded = True
+            else:
+                background_tasks.add_task(send_email_now, *build_form_email(email_data))
+        finally:
+            if not recorded:
+                lead_deduplicator.release(fingerprints)
         
         return SuccessResponse(
             message="Form submitted successfully. Data saved and email is being sent.",
@@ -369,92 +555,215 @@ async def submit_form(email_data: EmailRequest, background_tasks: BackgroundTask
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+def lead_page_response(serializer, rows, next_cursor):
+    """Encode a page of submissions, passing the next page's cursor in a header."""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return json_response(serializer.dump(rows), headers=headers)
+
 # New endpoints to get form submissions
 @app.get("/lease_submissions/", response_model=List[LeaseFormResponse])
-async def get_lease_submissions(db: Session = Depends(get_db)):
-    submissions = db.query(LeaseFormSubmission).all()
-    return submissions
+async def get_lease_submissions(params: Annotated[LeadQuery, Query()], db: AsyncSession = Depends(get_db)):
+    submissions, next_cursor = await query_leads(db, LeaseFormSubmission, params)
+    return lead_page_response(lease_serializer, submissions, next_cursor)
 
 @app.get("/sell_submissions/", response_model=List[SellFormResponse])
-async def get_sell_submissions(db: Session = Depends(get_db)):
-    submissions = db.query(SellFormSubmission).all()
-    return submissions
+async def get_sell_submissions(params: Annotated[LeadQuery, Query()], db: AsyncSession = Depends(get_db)):
+    submissions, next_cursor = await query_leads(db, SellFormSubmission, params)
+    return lead_page_response(sell_serializer, submissions, next_cursor)
 
 @app.get("/consultation_submissions/", response_model=List[ConsultationFormResponse])
-async def get_consultation_submissions(db: Session = Depends(get_db)):
-    submissions = db.query(ConsultationFormSubmission).all()
-    return submissions
-
-def process_tags(tags_string):
-    """Convert comma-separated tags string to a list."""
-    if not tags_string:
-        return []
-    return tags_string.split(',')
-
-def deal_to_response(deal):
-    """Convert Deal database model to DealResponse with tags processed."""
-    deal_dict = {
-        "id": deal.id,
-        "make": deal.make,
-        "model": deal.model,
-        "year": deal.year,
-        "image_url": deal.image_url,
-        "lease_price": deal.lease_price,
-        "term": deal.term,
-        "down_payment": deal.down_payment,
-        "mileage": deal.mileage,
-        "msrp": deal.msrp,
-        "savings": deal.savings,
-        "tags": process_tags(deal.tags),
-        "description": deal.description
-    }
-    return deal_dict
-
-def demo_to_response(demo):
-    """Convert Demo database model to DemoResponse with tags processed."""
-    demo_dict = {
-        "id": demo.id,
-        "make": demo.make,
-        "model": demo.model,
-        "year": demo.year,
-        "image_url": demo.image_url,
-        "lease_price": demo.lease_price,
-        "term": demo.term,
-        "down_payment": demo.down_payment,
-        "mileage": demo.mileage,
-        "msrp": demo.msrp,
-        "savings": demo.savings,
-        "tags": process_tags(demo.tags),
-        "description": demo.description
-    }
-    return demo_dict
+async def get_consultation_submissions(params: Annotated[LeadQuery, Query()], db: AsyncSession = Depends(get_db)):
+    submissions, next_cursor = await query_leads(db, ConsultationFormSubmission, params)
+    return lead_page_response(consultation_serializer, submissions, next_cursor)
 
-@app.get("/deals/", response_model=List[DealResponse])
-async def get_deals(db: Session = Depends(get_db)):
-    deals = db.query(Deal).all()
-    return [deal_to_response(deal) for deal in deals]
+@app.get("/exports/{table}")
+async def export_submissions(
+    table: str,
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+    created_after: Optional[datetime.datetime] = None,
+    created_before: Optional[datetime.datetime] = None,
+):
+    """Stream every row of a submission or inquiry table as CSV or NDJSON."""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown export table: {table}")
+    filename = export_filename(table, format, gzip)
+    return StreamingResponse(
+        export_stream(table, format, gzip, created_after, created_before),
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-@app.get("/demos/", response_model=List[DemoResponse])
-async def get_demos(db: Session = Depends(get_db)):
-    demos = db.query(Demo).all()
-    return [demo_to_response(demo) for demo in demos]
+async def resolve_tags(db: AsyncSession, tags_string):
+    """Look up (or create) the Tag rows for a comma-separated tags string."""
+    return await db.run_sync(get_or_create_tags, split_tags(tags_string))
 
-# Models for creating/updating deals and demos
-class DealCreateRequest(BaseModel):
-    make: str
-    model: str
-    year: int
-    image_url: str
-    lease_price: float
-    term: int
-    down_payment: float
-    mileage: int
-    msrp: float
-    savings: Optional[float] = None
-    tags: Optional[str] = None
-    description: Optional[str] = None
-    
-class DemoCreateRequest(BaseModel):
+def listing_to_response(listing):
+    """Convert a Deal or Demo database model to ListingResponse with tags processed."""
+    return listing_serializer.to_dict(listing)
+
+# URL namespace -> (label used in messages, model, facet index). The
+# namespace doubles as the listing's catalog cache namespace
+LISTING_KINDS = {
+    "deals": ("Deal", Deal, deal_facets),
+    "demos": ("Demo", Demo, demo_facets),
+}
+
+def listing_changed(namespace):
+    """Retire the cached catalog responses affected by a write to deals or demos."""
+    catalog_cache.bump(namespace)
+    # /listings serves both types, so any write retires it too
+    catalog_cache.bump("listings")
+
+def not_modified(etag):
+    """Build the 304 response for a request whose If-None-Match is still current."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+async def cached_listing_page(namespace, params, request, db):
+    """
+    Serve a catalog page through the catalog cache.
+
+    The cache holds the page already encoded as JSON, so a hit costs no
+    query, no validation and no encoding. Returns a bare 304 when the
+    client's If-None-Match matches the current version.
+    """
+    params_key = params.model_dump_json()
+    etag = catalog_cache.etag(namespace, params_key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+
+    async def load():
+        rows, next_cursor = await query_listings(db, LISTING_KINDS[namespace][1], params)
+        return listing_serializer.dump(rows), next_cursor
+
+    entry = await catalog_cache.get_or_load(namespace, params_key, load)
+    body, next_cursor = entry.value
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return json_response(body, headers=headers)
+
+@app.get("/deals/", response_model=List[ListingResponse])
+async def get_deals(request: Request, params: Annotated[ListingQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get deals matching the filters, one page at a time when a limit is given."""
+    return await cached_listing_page("deals", params, request, db)
+
+@app.get("/demos/", response_model=List[ListingResponse])
+async def get_demos(request: Request, params: Annotated[ListingQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get demos matching the filters, one page at a time when a limit is given."""
+    return await cached_listing_page("demos", params, request, db)
+
+# Most listings returned by the /top rankings
+MAX_TOP_K = 100
+
+@app.get("/deals/top", response_model=List[ListingResponse])
+async def get_top_deals(request: Request, k: int = Query(10, ge=1, le=MAX_TOP_K), make: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """Get the k best-value deals (lowest deal_score), optionally for one make."""
+    params = ListingQuery(make=make, sort="deal_score", limit=k)
+    return await cached_listing_page("deals", params, request, db)
+
+@app.get("/demos/top", response_model=List[ListingResponse])
+async def get_top_demos(request: Request, k: int = Query(10, ge=1, le=MAX_TOP_K), make: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """Get the k best-value demos (lowest deal_score), optionally for one make."""
+    params = ListingQuery(make=make, sort="deal_score", limit=k)
+    return await cached_listing_page("demos", params, request, db)
+
+async def cached_facets(namespace, request, db):
+    """Serve the facet counts for deals or demos through the catalog cache."""
+    etag = catalog_cache.etag(namespace, "facets")
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+
+    async def load():
+        index = LISTING_KINDS[namespace][2]
+        await index.load(db)
+        return to_json(index.to_dict())
+
+    entry = await catalog_cache.get_or_load(namespace, "facets", load)
+    return json_response(entry.value, headers={"ETag": entry.etag, "Cache-Control": "no-cache"})
+
+@app.get("/deals/facets", response_model=FacetsResponse)
+async def get_deal_facets(request: Request, db: AsyncSession = Depends(get_db)):
+    """Get makes, tags and lease price bounds across all deals."""
+    return await cached_facets("deals", request, db)
+
+@app.get("/demos/facets", response_model=FacetsResponse)
+async def get_demo_facets(request: Request, db: AsyncSession = Depends(get_db)):
+    """Get makes, tags and lease price bounds across all demos."""
+    return await cached_facets("demos", request, db)
+
+@app.get("/listings", response_model=ListingsResponse)
+async def get_listings(request: Request, params: Annotated[ListingFilters, Query()], db: AsyncSession = Depends(get_db)):
+    """
+    Get the first page of deals and of demos, with the facets of each, in one response.
+
+    Both pages come from a single windowed query. Each type's next_cursor
+    continues on /deals/ or /demos/ with the same filters.
+    """
+    params_key = params.model_dump_json()
+    etag = catalog_cache.etag("listings", params_key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+
+    async def load():
+        pages = await query_listings_by_type(db, params)
+        response = {}
+        for namespace, (_, model, index) in LISTING_KINDS.items():
+            await index.load(db)
+            rows, next_cursor = pages[model.__mapper__.polymorphic_identity]
+            response[namespace] = {
+                "items": listing_serializer.to_dicts(rows),
+                "next_cursor": next_cursor,
+                "facets": index.to_dict(),
+            }
+        return to_json(response)
+
+    entry = await catalog_cache.get_or_load("listings", params_key, load)
+    return json_response(entry.value, headers={"ETag": entry.etag, "Cache-Control": "no-cache"})
+
+@app.get("/search", response_model=List[ListingResponse])
+async def search_listings(request: Request, params: Annotated[SearchQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """
+    Search deals and demos by make, model, tags and description, best match first.
+
+    Price phrases such as "under 400" or "over 2k" filter on the lease
+    price, and the last word matches as a prefix while the shopper types.
+    """
+    params_key = "search:" + params.model_dump_json()
+    etag = catalog_cache.etag("listings", params_key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+
+    async def load():
+        ids = await listing_search.search(db, params)
+        if not ids:
+            return to_json([])
+        listings = {listing.id: listing for listing in (await db.execute(select(Listing).where(Listing.id.in_(ids)))).scalars()}
+        return listing_serializer.dump([listings[listing_id] for listing_id in ids if listing_id in listings])
+
+    entry = await catalog_cache.get_or_load("listings", params_key, load)
+    return json_response(entry.value, headers={"ETag": entry.etag, "Cache-Control": "no-cache"})
+
+@app.get("/autocomplete", response_model=List[SuggestionResponse])
+async def autocomplete(q: str = Query(..., max_length=100), limit: int = Query(8, ge=1, le=MAX_SUGGESTIONS), db: AsyncSession = Depends(get_db)):
+    """Suggest makes, models and tags starting with what the shopper has typed, most listed first."""
+    return json_response(to_json(await listing_search.autocomplete(db, q, limit)))
+
+@app.get("/quotes", response_model=List[QuoteResponse])
+async def get_quotes(params: Annotated[QuoteQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """
+    Reprice the catalog at the shopper's down payment, term and mileage.
+
+    Each listing's money factor is derived from its stored price and terms;
+    quotes for the whole inventory are computed in one vectorized pass and
+    returned cheapest first (or by total cost, see sort).
+    """
+    version = (catalog_cache.version("deals"), catalog_cache.version("demos"))
+    arrays = await quote_book.load(db, version)
+    return json_response(to_json(quote_catalog(arrays, params)))
+
+# Model for creating/updating deals and demos
+class ListingCreateRequest(BaseModel):
     make: str
     model: str
     year: int
@@ -468,237 +777,257 @@ class DemoCreateRequest(BaseModel):
     tags: Optional[str] = None
     description: Optional[str] = None
 
+async def store_image_variants(data, folder: str):
+    """Store the card/detail/full variants of an image and return their URLs."""
+    if sniff_image_type(data) is None:
+        raise HTTPException(status_code=400, detail="File must be a JPEG, PNG, GIF or WebP image")
+    upload_id = await run_in_threadpool(content_id, bytes(data))
+    try:
+        width = await run_in_threadpool(source_width, bytes(data))
+    except Exception as e:
+        print(f"Error reading image: {str(e)}")
+        raise HTTPException(status_code=400, detail="Could not read image")
+    full_key = full_variant_key(folder, upload_id, width)
+    image_url = public_url(full_key)
+    try:
+        # The same photo was stored before; its variants are already in the bucket
+        if await run_in_threadpool(object_exists, full_key):
+            return {"status": "success", "image_url": image_url, "image_srcset": image_srcset(image_url)}
+    except ValueError as e:
+        # Missing AWS settings
+        raise HTTPException(status_code=502, detail=f"Image storage is not configured: {str(e)}")
+    except (ClientError, BotoCoreError) as e:
+        print(f"Error checking for existing {folder} image: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Could not check for an existing image: {str(e)}")
+    except Exception as e:
+        print(f"Error checking for existing {folder} image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
+    try:
+        variants = await generate_variants(data, folder, upload_id)
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        raise HTTPException(status_code=400, detail="Could not read image")
+    try:
+        # Upload the smaller variants in parallel, off the event loop, then
+        # the full JPEG, whose presence marks the set as complete
+        await asyncio.gather(*[
+            run_in_threadpool(upload_bytes_to_s3, encoded, key, content_type)
+            for key, encoded, content_type in variants[:-1]
+        ])
+        key, encoded, content_type = variants[-1]
+        await run_in_threadpool(upload_bytes_to_s3, encoded, key, content_type)
+    except Exception as e:
+        print(f"Error uploading {folder} image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
+    return {"status": "success", "image_url": image_url, "image_srcset": image_srcset(image_url)}
+
 # Image upload endpoints
-@app.post("/upload/deal-image/", response_model=dict)
-async def upload_deal_image(file: UploadFile = File(...)):
-    """Upload an image for a deal to S3 and return the URL."""
+@app.post("/upload/deal-image/", response_model=dict, openapi_extra=IMAGE_UPLOAD_OPENAPI)
+async def upload_deal_image(request: Request):
+    """Upload an image for a deal to S3, with resized variants, and return the URLs."""
+    # Type and the 5MB limit are checked while the body streams in
+    file = await receive_image(request)
+    return await store_image_variants(file.data, "deals")
+
+@app.post("/upload/demo-image/", response_model=dict, openapi_extra=IMAGE_UPLOAD_OPENAPI)
+async def upload_demo_image(request: Request):
+    """Upload an image for a demo to S3, with resized variants, and return the URLs."""
+    file = await receive_image(request)
+    return await store_image_variants(file.data, "demos")
+
+@app.post("/uploads/presign", response_model=dict)
+async def presign_image_upload(params: PresignUploadRequest):
+    """Issue a presigned POST so the browser can upload a listing image straight to S3."""
     try:
-        # Verify file is an image
-        content_type = file.content_type
-        if not content_type or not content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Enforce file size limit (5MB)
-        file_size_limit = 5 * 1024 * 1024  # 5MB
-        file.file.seek(0, 2)  # Seek to the end of the file
-        file_size = file.file.tell()  # Get current position (file size)
-        file.file.seek(0)  # Reset to the beginning
-        
-        if file_size > file_size_limit:
-            raise HTTPException(status_code=400, detail=f"File size exceeds the 5MB limit")
-        
-        # Upload to S3 with 'deals' folder
-        image_url = upload_file_to_s3(file, folder="deals")
-        return {"status": "success", "image_url": image_url}
+        return await run_in_threadpool(presign_upload, params)
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Error in upload_deal_image: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
+        print(f"Error presigning upload: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to presign upload: {str(e)}")
 
-@app.post("/upload/demo-image/", response_model=dict)
-async def upload_demo_image(file: UploadFile = File(...)):
-    """Upload an image for a demo to S3 and return the URL."""
+@app.post("/uploads/complete", response_model=dict)
+async def complete_image_upload(params: CompleteUploadRequest):
+    """Verify a direct upload and store its resized variants, returning the URLs."""
+    await run_in_threadpool(check_uploaded_object, params.key)
     try:
-        # Verify file is an image
-        content_type = file.content_type
-        if not content_type or not content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Enforce file size limit (5MB)
-        file_size_limit = 5 * 1024 * 1024  # 5MB
-        file.file.seek(0, 2)  # Seek to the end of the file
-        file_size = file.file.tell()  # Get current position (file size)
-        file.file.seek(0)  # Reset to the beginning
-        
-        if file_size > file_size_limit:
-            raise HTTPException(status_code=400, detail=f"File size exceeds the 5MB limit")
-        
-        # Upload to S3 with 'demos' folder
-        image_url = upload_file_to_s3(file, folder="demos")
-        return {"status": "success", "image_url": image_url}
+        data = await run_in_threadpool(download_bytes, params.key)
+    except Exception as e:
+        print(f"Error reading uploaded image: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to read uploaded image: {str(e)}")
+    try:
+        result = await store_image_variants(data, params.key.split("/")[0])
     except HTTPException as he:
+        # An unreadable image is of no use; on other errors keep it so the client can retry
+        if he.status_code == 400:
+            await discard_upload(params.key)
         raise he
+    # Only the content-addressed variants are kept, so re-uploading a photo stores nothing new
+    await discard_upload(params.key)
+    return result
+
+async def discard_upload(key):
+    """Delete a direct upload's original once it has been processed."""
+    try:
+        await run_in_threadpool(delete_object, key)
     except Exception as e:
-        print(f"Error in upload_demo_image: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
+        print(f"Error deleting uploaded original {key}: {str(e)}")
 
-# CRUD endpoints for deals
-@app.post("/deals/", response_model=DealResponse)
-async def create_deal(
-    deal_data: DealCreateRequest,
-    db: Session = Depends(get_db)
-):
-    """Create a new deal with the provided data and image URL."""
+async def create_listing(namespace, listing_data: ListingCreateRequest, db: AsyncSession):
+    """Create a deal or demo with the provided data and image URL."""
+    label, model, facets = LISTING_KINDS[namespace]
+    await verify_image_url(listing_data.image_url)
     try:
-        # Create new Deal object
-        new_deal = Deal(
-            make=deal_data.make,
-            model=deal_data.model,
-            year=deal_data.year,
-            image_url=deal_data.image_url,  # Now expecting image_url in the request body
-            lease_price=deal_data.lease_price,
-            term=deal_data.term,
-            down_payment=deal_data.down_payment,
-            mileage=deal_data.mileage,
-            msrp=deal_data.msrp,
-            savings=deal_data.savings,
-            tags=deal_data.tags,
-            description=deal_data.description
+        listing = model(
+            **listing_data.model_dump(exclude={"tags"}),
+            tags=await resolve_tags(db, listing_data.tags),
         )
-        
+        score_listing(listing)
+
         # Add to database
-        db.add(new_deal)
-        db.commit()
-        db.refresh(new_deal)
-        
-        return deal_to_response(new_deal)
+        db.add(listing)
+        await db.commit()
+        listing_changed(namespace)
+        facets.add(listing_facets(listing))
+        await listing_search.saved(db, listing)
+
+        return listing_to_response(listing)
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to create deal: {str(e)}")
-
-@app.put("/deals/{deal_id}", response_model=DealResponse)
-async def update_deal(
-    deal_id: int,
-    deal_data: DealCreateRequest,
-    db: Session = Depends(get_db)
-):
-    """Update an existing deal by ID."""
-    # Find the deal
-    deal = db.query(Deal).filter(Deal.id == deal_id).first()
-    if not deal:
-        raise HTTPException(status_code=404, detail="Deal not found")
-    
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to create {label.lower()}: {str(e)}")
+
+def score_listing(listing):
+    """Recompute a listing's deal_score from its pricing fields."""
+    listing.deal_score = deal_score(listing.lease_price, listing.down_payment, listing.term, listing.msrp)
+
+async def get_listing_or_404(namespace, listing_id: int, db: AsyncSession):
+    """Load a deal or demo by ID; an ID belonging to the other type is not found."""
+    label, model, _ = LISTING_KINDS[namespace]
+    listing = await db.get(model, listing_id)
+    if not listing:
+        raise HTTPException(status_code=404, detail=f"{label} not found")
+    return listing
+
+async def update_listing(namespace, listing_id: int, listing_data: ListingCreateRequest, db: AsyncSession):
+    """Update an existing deal or demo by ID."""
+    label, _, facets = LISTING_KINDS[namespace]
+    listing = await get_listing_or_404(namespace, listing_id, db)
+    if listing_data.image_url != listing.image_url:
+        await verify_image_url(listing_data.image_url)
+
+    before = listing_facets(listing)
     try:
-        # Update deal attributes
-        deal.make = deal_data.make
-        deal.model = deal_data.model
-        deal.year = deal_data.year
-        deal.image_url = deal_data.image_url
-        deal.lease_price = deal_data.lease_price
-        deal.term = deal_data.term
-        deal.down_payment = deal_data.down_payment
-        deal.mileage = deal_data.mileage
-        deal.msrp = deal_data.msrp
-        deal.savings = deal_data.savings
-        deal.tags = deal_data.tags
-        deal.description = deal_data.description
-        
+        for name, value in listing_data.model_dump(exclude={"tags"}).items():
+            setattr(listing, name, value)
+        listing.tags = await resolve_tags(db, listing_data.tags)
+        score_listing(listing)
+
         # Commit changes
-        db.commit()
-        db.refresh(deal)
-        
-        return deal_to_response(deal)
+        await db.commit()
+        listing_changed(namespace)
+        facets.replace(before, listing_facets(listing))
+        await listing_search.saved(db, listing)
+
+        return listing_to_response(listing)
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to update deal: {str(e)}")
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to update {label.lower()}: {str(e)}")
 
-@app.delete("/deals/{deal_id}", response_model=dict)
-async def delete_deal(deal_id: int, db: Session = Depends(get_db)):
-    """Delete a deal by ID."""
-    deal = db.query(Deal).filter(Deal.id == deal_id).first()
-    if not deal:
-        raise HTTPException(status_code=404, detail="Deal not found")
-    
+async def delete_listing(namespace, listing_id: int, db: AsyncSession):
+    """Delete a deal or demo by ID."""
+    label, _, facets = LISTING_KINDS[namespace]
+    listing = await get_listing_or_404(namespace, listing_id, db)
+
+    before = listing_facets(listing)
     try:
-        db.delete(deal)
-        db.commit()
-        return {"status": "success", "message": f"Deal {deal_id} deleted successfully"}
+        await db.delete(listing)
+        await db.commit()
+        listing_changed(namespace)
+        facets.remove(before)
+        await listing_search.deleted(db, listing_id)
+        return {"status": "success", "message": f"{label} {listing_id} deleted successfully"}
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to delete deal: {str(e)}")
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to delete {label.lower()}: {str(e)}")
+
+# CRUD endpoints for deals
+@app.post("/deals/", response_model=ListingResponse)
+async def create_deal(deal_data: ListingCreateRequest, db: AsyncSession = Depends(get_db)):
+    """Create a new deal with the provided data and image URL."""
+    return await create_listing("deals", deal_data, db)
+
+@app.put("/deals/{deal_id}", response_model=ListingResponse)
+async def update_deal(deal_id: int, deal_data: ListingCreateRequest, db: AsyncSession = Depends(get_db)):
+    """Update an existing deal by ID."""
+    return await update_listing("deals", deal_id, deal_data, db)
+
+@app.delete("/deals/{deal_id}", response_model=dict)
+async def delete_deal(deal_id: int, db: AsyncSession = Depends(get_db)):
+    """Delete a deal by ID."""
+    return await delete_listing("deals", deal_id, db)
 
 # CRUD endpoints for demos
-@app.post("/demos/", response_model=DemoResponse)
-async def create_demo(
-    demo_data: DemoCreateRequest,
-    db: Session = Depends(get_db)
-):
+@app.post("/demos/", response_model=ListingResponse)
+async def create_demo(demo_data: ListingCreateRequest, db: AsyncSession = Depends(get_db)):
     """Create a new demo with the provided data and image URL."""
-    try:
-        # Create new Demo object
-        new_demo = Demo(
-            make=demo_data.make,
-            model=demo_data.model,
-            year=demo_data.year,
-            image_url=demo_data.image_url,  # Now expecting image_url in the request body
-            lease_price=demo_data.lease_price,
-            term=demo_data.term,
-            down_payment=demo_data.down_payment,
-            mileage=demo_data.mileage,
-            msrp=demo_data.msrp,
-            savings=demo_data.savings,
-            tags=demo_data.tags,
-            description=demo_data.description
-        )
-        
-        # Add to database
-        db.add(new_demo)
-        db.commit()
-        db.refresh(new_demo)
-        
-        return demo_to_response(new_demo)
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to create demo: {str(e)}")
-
-@app.put("/demos/{demo_id}", response_model=DemoResponse)
-async def update_demo(
-    demo_id: int,
-    demo_data: DemoCreateRequest,
-    db: Session = Depends(get_db)
-):
+    return await create_listing("demos", demo_data, db)
+
+@app.put("/demos/{demo_id}", response_model=ListingResponse)
+async def update_demo(demo_id: int, demo_data: ListingCreateRequest, db: AsyncSession = Depends(get_db)):
     """Update an existing demo by ID."""
-    # Find the demo
-    demo = db.query(Demo).filter(Demo.id == demo_id).first()
-    if not demo:
-        raise HTTPException(status_code=404, detail="Demo not found")
-    
-    try:
-        # Update demo attributes
-        demo.make = demo_data.make
-        demo.model = demo_data.model
-        demo.year = demo_data.year
-        demo.image_url = demo_data.image_url
-        demo.lease_price = demo_data.lease_price
-        demo.term = demo_data.term
-        demo.down_payment = demo_data.down_payment
-        demo.mileage = demo_data.mileage
-        demo.msrp = demo_data.msrp
-        demo.savings = demo_data.savings
-        demo.tags = demo_data.tags
-        demo.description = demo_data.description
-        
-        # Commit changes
-        db.commit()
-        db.refresh(demo)
-        
-        return demo_to_response(demo)
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to update demo: {str(e)}")
+    return await update_listing("demos", demo_id, demo_data, db)
 
 @app.delete("/demos/{demo_id}", response_model=dict)
-async def delete_demo(demo_id: int, db: Session = Depends(get_db)):
+async def delete_demo(demo_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a demo by ID."""
-    demo = db.query(Demo).filter(Demo.id == demo_id).first()
-    if not demo:
-        raise HTTPException(status_code=404, detail="Demo not found")
-    
+    return await delete_listing("demos", demo_id, db)
+
+# Largest import file accepted by /imports
+MAX_IMPORT_BYTES = 50 * 1024 * 1024
+
+@app.post("/imports/{table}", response_model=dict)
+async def import_listings(
+    table: str,
+    request: Request,
+    format: Literal["csv", "ndjson"] = "csv",
+    dry_run: bool = False,
+    delete_missing: bool = False,
+):
+    """
+    Bulk insert/update deals or demos from a CSV or NDJSON request body.
+
+    Rows are matched to existing listings by (year, make, model, term) and
+    all changes are applied in one transaction; with delete_missing,
+    listings absent from the file are deleted too. Nothing is written on
+    a dry run or when any row is invalid (422); the report lists what
+    would change either way.
+    """
+    if table not in IMPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown import table: {table}")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_IMPORT_BYTES:
+        raise HTTPException(status_code=400, detail="Import file exceeds the 50MB limit")
+    data = await request.body()
     try:
-        db.delete(demo)
-        db.commit()
-        return {"status": "success", "message": f"Demo {demo_id} deleted successfully"}
+        report = await run_in_threadpool(run_import, table, data, format, dry_run, delete_missing)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Import file must be UTF-8")
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to delete demo: {str(e)}")
+        print(f"Error importing {table}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to import {table}: {str(e)}")
+    if report["applied"]:
+        listing_changed(table)
+        LISTING_KINDS[table][2].invalidate()
+        listing_search.invalidate()
+    return json_response(to_json(report), status_code=422 if report["errors"] else 200)
 
-def save_vehicle_inquiry_to_db(inquiry_data: VehicleInquiryRequest, db: Session):
+async def save_vehicle_inquiry_to_db(inquiry_data: VehicleInquiryRequest, db: AsyncSession):
     """Save vehicle inquiry to the appropriate database table"""
     try:
         if inquiry_data.vehicleType.lower() == "deal":
             # Create a new deal inquiry submission
-            db_submission = DealInquirySubmission(
+            submission_model = DealInquirySubmission
+            values = dict(
                 first_name=inquiry_data.firstName,
                 last_name=inquiry_data.lastName,
                 email=inquiry_data.email,
@@ -716,7 +1045,8 @@ def save_vehicle_inquiry_to_db(inquiry_data: VehicleInquiryRequest, db: Session)
             )
         elif inquiry_data.vehicleType.lower() == "demo":
             # Create a new demo inquiry submission
-            db_submission = DemoInquirySubmission(
+            submission_model = DemoInquirySubmission
+            values = dict(
                 first_name=inquiry_data.firstName,
                 last_name=inquiry_data.lastName,
                 email=inquiry_data.email,
@@ -737,21 +1067,18 @@ def save_vehicle_inquiry_to_db(inquiry_data: VehicleInquiryRequest, db: Session)
             print(f"Invalid vehicle type: {inquiry_data.vehicleType}")
             return False
             
-        db.add(db_submission)
-        db.commit()
-        db.refresh(db_submission)
+        subject, body = build_vehicle_inquiry_email(inquiry_data)
+        vehicle_type = inquiry_data.vehicleType.lower()
+        notification = outbox_values(f"{vehicle_type} inquiry", subject, body, reference=f"{vehicle_type}:{inquiry_data.vehicleId}")
+        await write_rows(db, [(submission_model, values), (EmailOutbox, notification)])
         return True
     except Exception as e:
         print(f"Error saving vehicle inquiry to database: {e}")
-        db.rollback()
+        await db.rollback()
         return False
 
-def send_vehicle_inquiry_email(inquiry_data: VehicleInquiryRequest):
-    """Send email for vehicle inquiry (deal or demo)"""
-    sg = sendgrid.SendGridAPIClient(api_key=os.getenv("SENDGRID_API_KEY"))
-    from_email = Email(os.getenv("SENDGRID_FROM_EMAIL"))
-    to_email = To(os.getenv("RECEIVER_EMAIL"))
-    
+def build_vehicle_inquiry_email(inquiry_data: VehicleInquiryRequest):
+    """Return the (subject, body) of the notification for a vehicle inquiry (deal or demo)"""
     vehicle_type = inquiry_data.vehicleType.capitalize()
     subject = f"New {vehicle_type} Inquiry - {inquiry_data.vehicleYear} {inquiry_data.vehicleMake} {inquiry_data.vehicleModel}"
     
@@ -795,39 +1122,50 @@ def send_vehicle_inquiry_email(inquiry_data: VehicleInquiryRequest):
     {inquiry_data.description}
     """
     
-    content = Content("text/plain", email_body)
-    mail = Mail(from_email, to_email, subject, content)
-
-    try:
-        response = sg.send(mail)
-        if response.status_code == 202:
-            print(f"Vehicle inquiry email sent successfully with status code {response.status_code}")
-            return True
-        else:
-            print(f"Failed to send vehicle inquiry email with status code {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"Error sending vehicle inquiry email: {e}")
-        return False
+    return subject, email_body
 
 @app.post("/vehicle_inquiry/", response_model=SuccessResponse, responses={
     200: {"model": SuccessResponse},
     400: {"model": ErrorResponse},
     500: {"model": ErrorResponse}
 })
-async def submit_vehicle_inquiry(inquiry_data: VehicleInquiryRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def submit_vehicle_inquiry(inquiry_data: VehicleInquiryRequest, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
     """
     Handle vehicle inquiries from the deals and demos pages
     """
     try:
-        # Save to database
-        db_success = save_vehicle_inquiry_to_db(inquiry_data, db)
-        
-        # Send email in the background
-        background_tasks.add_task(send_vehicle_inquiry_email, inquiry_data)
+        message = f"{inquiry_data.vehicleType.capitalize()} inquiry submitted successfully. An email will be sent to our team."
+        vehicle_type = inquiry_data.vehicleType.lower()
+        fingerprints = lead_fingerprints(
+            f"{vehicle_type} inquiry", f"{vehicle_type}:{inquiry_data.vehicleId}", inquiry_data.email, inquiry_data.phoneNumber
+        )
+        if await lead_deduplicator.is_duplicate(fingerprints):
+            return SuccessResponse(
+                message=message,
+                data={"vehicleType": inquiry_data.vehicleType, "vehicleId": inquiry_data.vehicleId, "database_saved": True, "duplicate": True}
+            )
+
+        # The reservation made by is_duplicate is dropped unless the lead is
+        # recorded, including when saving raises or the request is cancelled
+        recorded = False
+        try:
+            # Save to database
+            db_success = await save_vehicle_inquiry_to_db(inquiry_data, db)
+
+            # The notification was queued in the outbox with the inquiry; if
+            # that failed, fall back to sending it straight away
+            if db_success:
+                outbox_worker.notify()
+                await lead_deduplicator.record(f"{vehicle_type} inquiry", fingerprints)
+                recorded = True
+            else:
+                background_tasks.add_task(send_email_now, *build_vehicle_inquiry_email(inquiry_data))
+        finally:
+            if not recorded:
+                lead_deduplicator.release(fingerprints)
         
         return SuccessResponse(
-            message=f"{inquiry_data.vehicleType.capitalize()} inquiry submitted successfully. An email will be sent to our team.",
+            message=message,
             data={"vehicleType": inquiry_data.vehicleType, "vehicleId": inquiry_data.vehicleId, "database_saved": db_success}
         )
     except HTTPException as he:
@@ -839,29 +1177,57 @@ async def submit_vehicle_inquiry(inquiry_data: VehicleInquiryRequest, background
         )
 
 @app.get("/deal_inquiries/", response_model=List[DealInquiryResponse])
-async def get_deal_inquiries(db: Session = Depends(get_db)):
-    """Get all deal inquiry submissions"""
-    inquiries = db.query(DealInquirySubmission).all()
-    return inquiries
+async def get_deal_inquiries(params: Annotated[DealInquiryQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get deal inquiry submissions, newest first, one page at a time"""
+    inquiries, next_cursor = await query_leads(db, DealInquirySubmission, params)
+    return lead_page_response(deal_inquiry_serializer, inquiries, next_cursor)
 
 @app.get("/deal_inquiries/{inquiry_id}", response_model=DealInquiryResponse)
-async def get_deal_inquiry(inquiry_id: int, db: Session = Depends(get_db)):
+async def get_deal_inquiry(inquiry_id: int, db: AsyncSession = Depends(get_db)):
     """Get a specific deal inquiry submission by ID"""
-    inquiry = db.query(DealInquirySubmission).filter(DealInquirySubmission.id == inquiry_id).first()
+    inquiry = await db.get(DealInquirySubmission, inquiry_id)
     if not inquiry:
         raise HTTPException(status_code=404, detail="Deal inquiry not found")
     return inquiry
 
 @app.get("/demo_inquiries/", response_model=List[DemoInquiryResponse])
-async def get_demo_inquiries(db: Session = Depends(get_db)):
-    """Get all demo inquiry submissions"""
-    inquiries = db.query(DemoInquirySubmission).all()
-    return inquiries
+async def get_demo_inquiries(params: Annotated[DemoInquiryQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get demo inquiry submissions, newest first, one page at a time"""
+    inquiries, next_cursor = await query_leads(db, DemoInquirySubmission, params)
+    return lead_page_response(demo_inquiry_serializer, inquiries, next_cursor)
 
 @app.get("/demo_inquiries/{inquiry_id}", response_model=DemoInquiryResponse)
-async def get_demo_inquiry(inquiry_id: int, db: Session = Depends(get_db)):
+async def get_demo_inquiry(inquiry_id: int, db: AsyncSession = Depends(get_db)):
     """Get a specific demo inquiry submission by ID"""
-    inquiry = db.query(DemoInquirySubmission).filter(DemoInquirySubmission.id == inquiry_id).first()
+    inquiry = await db.get(DemoInquirySubmission, inquiry_id)
     if not inquiry:
         raise HTTPException(status_code=404, detail="Demo inquiry not found")
-    return inquiry
\ No newline at end of file
+    return inquiry
+
+class InquiryRankingResponse(BaseModel):
+    listing_type: str
+    listing_id: int
+    inquiries: int
+    make: Optional[str] = None
+    model: Optional[str] = None
+    year: Optional[int] = None
+
+class InquiryDayResponse(BaseModel):
+    day: datetime.date
+    inquiries: int
+
+# Lead analytics, served from the daily rollup tables
+@app.get("/analytics/inquiries", response_model=List[InquiryRankingResponse])
+async def get_inquiry_ranking(params: Annotated[InquiryRankingQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get the deals and demos with the most inquiries between start and end (default: last 30 days)."""
+    return json_response(to_json(await inquiry_ranking(db, params)))
+
+@app.get("/analytics/inquiries/daily", response_model=List[InquiryDayResponse])
+async def get_inquiry_series(params: Annotated[InquirySeriesQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get inquiries per day, for one listing or all of them."""
+    return json_response(to_json(await inquiry_series(db, params)))
+
+@app.get("/analytics/submissions", response_model=List[dict])
+async def get_submission_rollup(params: Annotated[SubmissionRollupQuery, Query()], db: AsyncSession = Depends(get_db)):
+    """Get form and inquiry submissions grouped by day, form type or zip code prefix."""
+    return json_response(to_json(await submission_rollup(db, params)))
@@ -0,0 +1,260 @@
+import contextvars
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram bucket upper bounds, in seconds or counts
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, _labels(self.labelnames, key), value
+
+class Histogram:
+    """
+    Observations bucketed by upper bound, per label combination.
+
+    Each observation increments one bucket (found by bisection) and a
+    sum; buckets are made cumulative only when the metrics are rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Bucket counts, then the sum
+                series = self._values[key] = [0] * len(self.buckets) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block, with outcome="ok" or "error" if that is a label."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            if "outcome" in self.labelnames:
+                labels["outcome"] = outcome
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + "_bucket", _labels(self.labelnames, key, f'le="{_format_value(bound)}"'), cumulative
+            yield self.name + "_sum", _labels(self.labelnames, key), series[-1]
+            yield self.name + "_count", _labels(self.labelnames, key), cumulative
+
+class CallbackGauge:
+    """Gauge read from a function when the metrics are rendered, e.g. a queue's current depth."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        """The callback returns a number, or with labels a dict of label value tuples -> number."""
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return
+        if not self.labelnames:
+            yield self.name, "", value
+            return
+        for key, item in value.items():
+            yield self.name, _labels(self.labelnames, key), item
+
+class Registry:
+    """Every metric of the process, rendered together for GET /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self.register(CallbackGauge(name, documentation, callback, labelnames))
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status code.", ("method", "route", "status")
+)
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time until the response was sent, by route template.", ("method", "route")
+)
+http_request_db_statements = registry.histogram(
+    "http_request_db_statements", "SQL statements executed per request.", ("method", "route"), COUNT_BUCKETS
+)
+http_request_db_seconds = registry.histogram(
+    "http_request_db_seconds", "Time spent executing SQL statements per request.", ("method", "route")
+)
+db_statement_seconds = registry.histogram(
+    "db_statement_duration_seconds", "SQL statement execution time, by engine.", ("engine",), STATEMENT_BUCKETS
+)
+s3_upload_seconds = registry.histogram(
+    "s3_upload_duration_seconds", "S3 upload time, by operation and outcome.", ("operation", "outcome")
+)
+sendgrid_send_seconds = registry.histogram(
+    "sendgrid_send_duration_seconds", "SendGrid send time, by outcome.", ("outcome",)
+)
+
+class RequestDatabaseTime:
+    """SQL statements and time attributed to the current request."""
+
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+# Set by MetricsMiddleware for the duration of each request. Sync
+# sessions run in thread pools that copy the context, and async ones in
+# greenlets that share it, so statements are attributed either way
+current_request_database_time = contextvars.ContextVar("current_request_database_time", default=None)
+
+def instrument_engine(engine, name):
+    """Time every statement run by a sync engine (use async_engine.sync_engine for async)."""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        db_statement_seconds.observe(elapsed, engine=name)
+        request = current_request_database_time.get()
+        if request is not None:
+            request.statements += 1
+            request.seconds += elapsed
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording each request's count, latency and SQL time.
+
+    Requests are labelled with their route template (e.g.
+    "/deals/{deal_id}"), not the raw path, so the number of series stays
+    bounded; requests no route matched are labelled "unmatched". Latency
+    runs until the last body chunk is sent, so background tasks that run
+    after the response don't count towards it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        database_time = RequestDatabaseTime()
+        token = current_request_database_time.set(database_time)
+        status = 500
+        finished = None
+
+        async def send_with_metrics(message):
+            nonlocal status, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_request_database_time.reset(token)
+            route = scope.get("route")
+            labels = {"method": scope["method"], "route": getattr(route, "path", "unmatched")}
+            http_requests.inc(status=str(status), **labels)
+            http_request_seconds.observe((finished or time.perf_counter()) - start, **labels)
+            http_request_db_statements.observe(database_time.statements, **labels)
+            http_request_db_seconds.observe(database_time.seconds, **labels)
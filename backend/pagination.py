@@ -0,0 +1,86 @@
+import base64
+import binascii
+import datetime
+import json
+from fastapi import HTTPException
+from sqlalchemy import and_, false, or_
+
+# Header used by list endpoints to hand the client the cursor for the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row of a page as an opaque cursor string (NULLs as null)."""
+    payload = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, types):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor: Cursor string from the client
+        types: Python type of each value in the cursor, in order
+
+    Returns:
+        list: The decoded sort key values, with None for NULLs
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("cursor has the wrong shape")
+        return [
+            None if value is None
+            else datetime.datetime.fromisoformat(value) if value_type is datetime.datetime
+            else value_type(value)
+            for value, value_type in zip(values, types)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_after(columns, values, descending=False):
+    """
+    Build a filter selecting rows that sort strictly after `values`.
+
+    Expands the row-value comparison (a, b) > (x, y) into
+    a > x OR (a = x AND b > y) so it works on both MySQL and SQLite
+    and can be answered by a range scan on a matching composite index.
+
+    NULLs are placed the way both databases order them: below every
+    value, so first in ascending order and last in descending order.
+    """
+    clauses = []
+    for position, column in enumerate(columns):
+        equal = [column_equals(columns[i], values[i]) for i in range(position)]
+        clauses.append(and_(*equal, column_after(column, values[position], descending)))
+    return or_(*clauses)
+
+def column_equals(column, value):
+    return column.is_(None) if value is None else column == value
+
+def column_after(column, value, descending):
+    """Filter for values of one sort column strictly after `value`, with NULL sorting lowest."""
+    if value is None:
+        return false() if descending else column.isnot(None)
+    if not descending:
+        # NULL > value is never true, so NULLs stay behind
+        return column > value
+    if column.expression.nullable:
+        return or_(column < value, column.is_(None))
+    return column < value
+
+async def fetch_page(db, statement, sort_columns, limit):
+    """
+    Fetch one page of ORM rows from an already ordered select statement.
+
+    Returns:
+        tuple: (rows, cursor for the next page or None)
+    """
+    # Fetch one extra row to find out whether another page exists
+    rows = (await db.execute(statement.limit(limit + 1))).scalars().all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(*[getattr(last, column.key) for column in sort_columns])
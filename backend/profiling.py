@@ -0,0 +1,253 @@
+import asyncio
+import datetime
+import hmac
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from database import env_flag
+
+# The middleware is only installed when this is set, so profiling costs
+# nothing otherwise
+PROFILING_ENABLED = env_flag("PROFILING_ENABLED", "false")
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Fraction of requests profiled without the header (0 profiles only on request)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Value of the X-Profile header that asks for a request to be profiled
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or os.getenv("ADMIN_PASSWORD")
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+
+# Profiles kept in PROFILE_DIR; older ones are deleted
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Leaf of a stack sampled while the request's task was suspended
+WAITING = "(waiting)"
+
+def frame_label(frame):
+    """Label a frame by function and file, without line numbers, so samples in one function aggregate."""
+    code = frame.f_code
+    filename = code.co_filename.replace("\\", "/")
+    if "site-packages/" in filename:
+        filename = filename.split("site-packages/")[-1]
+    else:
+        filename = filename.rsplit("/", 1)[-1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def thread_stack(frame, root):
+    """Labels from `root` (the task's outermost coroutine frame) down to `frame`."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    return labels[::-1]
+
+def coroutine_stack(coroutine):
+    """Labels of a suspended coroutine and everything it is awaiting."""
+    labels = []
+    while coroutine is not None:
+        frame = getattr(coroutine, "cr_frame", None) or getattr(coroutine, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(frame_label(frame))
+        coroutine = getattr(coroutine, "cr_await", None) or getattr(coroutine, "gi_yieldfrom", None)
+    labels.append(WAITING)
+    return labels
+
+class RequestSampler:
+    """
+    Samples one asyncio task's stack from a background thread.
+
+    While the task is running, the event loop thread's stack is taken;
+    while it is suspended, its chain of awaited coroutines ending in
+    "(waiting)". Each sample is weighted by the wall time since the
+    previous one, so waits on the database or network show up alongside
+    CPU time. Work handed to thread pools appears as waiting in the call
+    that awaits it (e.g. run_in_threadpool).
+    """
+
+    def __init__(self, task, interval):
+        self.task = task
+        self.loop = task.get_loop()
+        self.thread_id = threading.get_ident()
+        self.root = task.get_coro().cr_frame
+        self.interval = interval
+        self.weights = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        last = self.started
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self.sample(now - last)
+            last = now
+
+    def sample(self, weight):
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = thread_stack(frame, self.root)
+        else:
+            stack = coroutine_stack(self.task.get_coro())
+        if self._stop.is_set():
+            # Taken while stop() was waiting for this thread
+            return
+        self.weights[tuple(stack)] += weight
+        self.samples += 1
+
+def collapsed_stacks(weights):
+    """Stacks in the collapsed format flamegraph.pl and speedscope read, weighted in microseconds."""
+    lines = [f"{';'.join(stack)} {round(weight * 1e6)}" for stack, weight in weights.items() if stack]
+    return "\n".join(sorted(lines)) + "\n"
+
+def speedscope_profile(name, weights, duration):
+    """A speedscope "sampled" profile (https://www.speedscope.app), weighted in seconds."""
+    frames, indexes = [], {}
+    samples, sample_weights = [], []
+    for stack, weight in weights.items():
+        sample = []
+        for label in stack:
+            if label not in indexes:
+                indexes[label] = len(frames)
+                frames.append({"name": label})
+            sample.append(indexes[label])
+        samples.append(sample)
+        sample_weights.append(weight)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": duration,
+            "samples": samples,
+            "weights": sample_weights,
+        }],
+        "exporter": "cardealbroker profiling.py",
+    }
+
+class Profiler:
+    """Decides which requests to profile, and writes and lists their profiles."""
+
+    def __init__(self, directory=PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, token=PROFILE_TOKEN,
+                 interval_ms=PROFILE_INTERVAL_MS, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self.recent = deque(maxlen=keep)
+        self._files = deque()
+
+    def wanted(self, scope):
+        """Whether to profile a request: it carries the profiling token, or it was sampled."""
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token.encode())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def new_id(self):
+        return f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{secrets.token_hex(4)}"
+
+    def save(self, profile_id, scope, status, sampler):
+        """Write a request's profile files and return its listing entry. Blocking; run it in a thread."""
+        created_at = datetime.datetime.utcnow()
+        name = f"{scope['method']} {scope['path']}"
+        os.makedirs(self.directory, exist_ok=True)
+        files = {
+            "speedscope": f"{profile_id}.speedscope.json",
+            "collapsed": f"{profile_id}.collapsed.txt",
+        }
+        with open(os.path.join(self.directory, files["speedscope"]), "w") as f:
+            json.dump(speedscope_profile(name, sampler.weights, sampler.duration), f)
+        with open(os.path.join(self.directory, files["collapsed"]), "w") as f:
+            f.write(collapsed_stacks(sampler.weights))
+
+        self._files.append(files.values())
+        while len(self._files) > self.keep:
+            for filename in self._files.popleft():
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+        entry = {
+            "id": profile_id,
+            "created_at": created_at.isoformat(),
+            "request": name,
+            "status": status,
+            "duration_ms": round(sampler.duration * 1000, 3),
+            "samples": sampler.samples,
+            "files": files,
+        }
+        self.recent.appendleft(entry)
+        return entry
+
+    def path(self, filename):
+        """Path of one of this process's recent profile files, or None."""
+        for entry in self.recent:
+            if filename in entry["files"].values():
+                return os.path.join(self.directory, filename)
+        return None
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests chosen by Profiler.wanted.
+
+    A profiled response carries an X-Profile-Id header naming its entry
+    in GET /internal/profiles. Other requests only pay for the check.
+    """
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        profile_id = self.profiler.new_id()
+        sampler = RequestSampler(asyncio.current_task(), self.profiler.interval)
+        status = None
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (PROFILE_ID_HEADER, profile_id.encode())]}
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.stop()
+            entry = await asyncio.to_thread(self.profiler.save, profile_id, scope, status, sampler)
+            print(f"Profiled {entry['request']} in {entry['duration_ms']}ms: {entry['files']['speedscope']}")
+
+profiler = Profiler()
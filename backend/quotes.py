@@ -0,0 +1,216 @@
+import asyncio
+from typing import Literal, Optional
+import numpy as np
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+
+from database import Listing
+
+# Residual value as a fraction of MSRP by lease term in months, at
+# BASE_ANNUAL_MILES. Terms in between are interpolated, and terms outside
+# the table use its first or last value
+RESIDUAL_TERMS = np.array([24, 36, 39, 48, 60], dtype=np.float64)
+RESIDUAL_RATES = np.array([0.66, 0.58, 0.56, 0.50, 0.42], dtype=np.float64)
+
+# Annual mileage the residual table assumes
+BASE_ANNUAL_MILES = 12000
+
+# Residual change per 1,000 annual miles below (+) or above (-) the base
+RESIDUAL_PER_THOUSAND_MILES = 0.01
+
+# Range of money factors derived from listings. A listed price the
+# residual table can't explain with a rate in this range is explained by
+# a per-listing residual adjustment instead (a subsidized or weak residual)
+MAX_MONEY_FACTOR = 0.006
+
+# Bounds of that per-listing residual adjustment, relative to the table
+RESIDUAL_ADJUSTMENT_RANGE = (0.5, 1.5)
+
+# Most quotes returned by one request
+MAX_QUOTES = 5000
+
+QUOTE_TYPES = {"deals": "deal", "demos": "demo"}
+
+class QuoteQuery(BaseModel):
+    """Shopper terms accepted by GET /quotes."""
+    down_payment: float = Field(0, ge=0)
+    term: int = Field(36, ge=12, le=84)
+    mileage: int = Field(BASE_ANNUAL_MILES, ge=5000, le=30000)
+    listing_type: Optional[Literal["deals", "demos"]] = None
+    make: Optional[str] = None
+    max_payment: Optional[float] = Field(None, gt=0)
+    sort: Literal["monthly_payment", "-monthly_payment", "total_cost", "-total_cost"] = "monthly_payment"
+    limit: int = Field(100, ge=1, le=MAX_QUOTES)
+
+def residual_rate(term, mileage):
+    """
+    Residual value as a fraction of MSRP for the given terms.
+
+    Args:
+        term: Lease term in months (scalar or array)
+        mileage: Annual mileage allowance (scalar or array)
+
+    Returns:
+        numpy.ndarray: Residual rate, never below zero
+    """
+    rate = np.interp(term, RESIDUAL_TERMS, RESIDUAL_RATES)
+    rate = rate + (BASE_ANNUAL_MILES - np.asarray(mileage, dtype=np.float64)) / 1000 * RESIDUAL_PER_THOUSAND_MILES
+    return np.maximum(rate, 0.0)
+
+def lease_payment(msrp, down_payment, term, residual, money_factor):
+    """
+    Monthly lease payment before taxes and fees: depreciation plus rent charge.
+
+    All arguments may be arrays; they are broadcast together.
+    """
+    capitalized_cost = msrp - down_payment
+    return (capitalized_cost - residual) / term + (capitalized_cost + residual) * money_factor
+
+def implied_lease_parameters(lease_price, msrp, down_payment, term, mileage):
+    """
+    Derive each listing's residual adjustment and money factor from its listed price.
+
+    The residual table gives a first residual, and the payment formula is
+    solved for the money factor that reproduces the price. Where that
+    factor falls outside [0, MAX_MONEY_FACTOR], it is held at the bound
+    and the formula is solved for the residual instead, so a listing
+    quoted at its own terms comes back at (close to) its own price.
+
+    Returns:
+        tuple: (residual adjustment relative to the table, money factor) arrays
+    """
+    capitalized_cost = msrp - down_payment
+    table_residual = msrp * residual_rate(term, mileage)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        money_factor = (lease_price - (capitalized_cost - table_residual) / term) / (capitalized_cost + table_residual)
+        money_factor = np.clip(np.nan_to_num(money_factor, nan=0.0), 0.0, MAX_MONEY_FACTOR)
+        # Payment is linear in the residual, with slope money_factor - 1 / term
+        residual = (lease_price - capitalized_cost / term - capitalized_cost * money_factor) / (money_factor - 1 / term)
+        adjustment = np.nan_to_num(residual / table_residual, nan=1.0)
+    return np.clip(adjustment, *RESIDUAL_ADJUSTMENT_RANGE), money_factor
+
+class QuoteBook:
+    """
+    Column arrays of every listing's pricing inputs, for vectorized quotes.
+
+    The arrays, and each listing's residual adjustment and money factor
+    derived from its stored price and terms, are computed once per catalog
+    version and reused by every quote request until a write changes it.
+    """
+
+    # Listing columns loaded into the book, besides the derived ones
+    COLUMNS = ("id", "listing_type", "year", "make", "model", "image_url", "lease_price", "msrp")
+
+    def __init__(self):
+        self.version = None
+        self.arrays = None
+        self._lock = asyncio.Lock()
+
+    async def load(self, db, version):
+        """Rebuild the arrays from the database unless they match the given catalog version."""
+        if self.version == version:
+            return self.arrays
+        async with self._lock:
+            if self.version == version:
+                return self.arrays
+            rows = (await db.execute(
+                select(*[getattr(Listing, name) for name in self.COLUMNS], Listing.term, Listing.down_payment, Listing.mileage)
+                .where(Listing.lease_price > 0, Listing.msrp > 0, Listing.term > 0)
+                .order_by(Listing.id)
+            )).all()
+            self.arrays = build_arrays(rows)
+            self.version = version
+            return self.arrays
+
+    def invalidate(self):
+        """Drop the arrays so the next request reloads them."""
+        self.version = None
+        self.arrays = None
+
+def build_arrays(rows):
+    """
+    Turn (id, listing_type, year, make, model, image_url, lease_price, msrp,
+    term, down_payment, mileage) rows into the quote book's arrays.
+
+    Returns:
+        dict: Column name -> numpy array, plus the derived
+        "residual_adjustment" and "money_factor"
+    """
+    columns = list(zip(*rows)) or [()] * 11
+    ids, listing_types, years, makes, models, image_urls, prices, msrps, terms, downs, mileages = columns
+    msrp = np.array(msrps, dtype=np.float64)
+    term = np.array(terms, dtype=np.float64)
+    down_payment = np.array(downs, dtype=np.float64)
+    lease_price = np.array(prices, dtype=np.float64)
+    residual_adjustment, money_factor = implied_lease_parameters(
+        lease_price, msrp, down_payment, term, np.array(mileages, dtype=np.float64)
+    )
+    return {
+        "id": np.array(ids, dtype=np.int64),
+        "listing_type": np.array(listing_types, dtype=object),
+        "year": np.array(years, dtype=np.int64),
+        "make": np.array(makes, dtype=object),
+        "model": np.array(models, dtype=object),
+        "image_url": np.array(image_urls, dtype=object),
+        "lease_price": lease_price,
+        "msrp": msrp,
+        "residual_adjustment": residual_adjustment,
+        "money_factor": money_factor,
+    }
+
+def quote_catalog(arrays, params: QuoteQuery):
+    """
+    Reprice every listing at the shopper's terms in one vectorized pass.
+
+    Each listing keeps the money factor and residual adjustment implied by
+    its own listed price; the residual comes from the table at the
+    requested term and mileage, scaled by that adjustment.
+
+    Returns:
+        list: Quote dicts for the matching listings, sorted and limited
+    """
+    mask = np.ones(len(arrays["id"]), dtype=bool)
+    if params.listing_type:
+        mask &= arrays["listing_type"] == QUOTE_TYPES[params.listing_type]
+    if params.make:
+        mask &= arrays["make"] == params.make
+
+    msrp = arrays["msrp"]
+    residual = np.minimum(msrp * residual_rate(params.term, params.mileage) * arrays["residual_adjustment"], msrp)
+    payment = lease_payment(msrp, params.down_payment, params.term, residual, arrays["money_factor"])
+    # A down payment beyond the vehicle's residual value gives no sensible lease
+    mask &= payment > 0
+    if params.max_payment is not None:
+        mask &= payment <= params.max_payment
+    total_cost = payment * params.term + params.down_payment
+
+    indexes = np.flatnonzero(mask)
+    sort_values = (total_cost if params.sort.lstrip("-") == "total_cost" else payment)[indexes]
+    if params.sort.startswith("-"):
+        sort_values = -sort_values
+    if params.limit < len(indexes):
+        # Only the returned rows need a full sort
+        top = np.argpartition(sort_values, params.limit - 1)[:params.limit]
+        order = top[np.argsort(sort_values[top], kind="stable")]
+    else:
+        order = np.argsort(sort_values, kind="stable")
+    indexes = indexes[order]
+
+    rounded_payment = np.round(payment[indexes], 2).tolist()
+    rounded_total = np.round(total_cost[indexes], 2).tolist()
+    return [
+        {
+            "id": int(arrays["id"][index]),
+            "listing_type": arrays["listing_type"][index],
+            "year": int(arrays["year"][index]),
+            "make": arrays["make"][index],
+            "model": arrays["model"][index],
+            "image_url": arrays["image_url"][index],
+            "lease_price": float(arrays["lease_price"][index]),
+            "monthly_payment": rounded_payment[position],
+            "total_cost": rounded_total[position],
+        }
+        for position, index in enumerate(indexes.tolist())
+    ]
+
+quote_book = QuoteBook()
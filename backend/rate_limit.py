@@ -0,0 +1,207 @@
+import math
+import os
+import time
+from collections import OrderedDict
+
+from database import env_flag
+
+RATE_LIMIT_ENABLED = env_flag("RATE_LIMIT_ENABLED", "true")
+
+# Proxies in front of the app that append to X-Forwarded-For (Railway's
+# edge is one). The client address is taken that many entries from the
+# right, so addresses a client puts in the header itself are ignored. 0
+# uses the connection's peer address
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", "1"))
+
+def parse_limit(value):
+    """
+    Parse a "requests/seconds" limit, e.g. "5/60".
+
+    Returns:
+        tuple: (bucket capacity, tokens refilled per second)
+    """
+    requests, seconds = value.split("/")
+    return int(requests), int(requests) / float(seconds)
+
+# POST path -> (burst, refill per second), per client address
+RATE_LIMITS = {
+    "/submit_form/": parse_limit(os.getenv("RATE_LIMIT_SUBMIT_FORM", "5/60")),
+    "/vehicle_inquiry/": parse_limit(os.getenv("RATE_LIMIT_VEHICLE_INQUIRY", "5/60")),
+    "/admin/login": parse_limit(os.getenv("RATE_LIMIT_ADMIN_LOGIN", "5/300")),
+}
+
+class MemoryBucketStore:
+    """
+    Token buckets in a bounded, least-recently-used ordered dict.
+
+    Each take is a pop and a re-insert at the end, and past max_keys the
+    bucket of the client seen longest ago is dropped, so the cost per
+    request stays constant however many distinct clients there are. A
+    dropped client starts over with a full bucket. Buckets are per
+    process; use RedisBucketStore to share them between workers.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.evictions = 0
+
+    def consume(self, key, capacity, refill_rate, now=None):
+        """
+        Take a token from a bucket, creating it full if it is new.
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is available
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.pop(key, None)
+        tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / refill_rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+            self.evictions += 1
+        return wait
+
+    async def take(self, key, capacity, refill_rate):
+        return self.consume(key, capacity, refill_rate)
+
+    def stats(self):
+        return {"backend": "memory", "keys": len(self.buckets), "max_keys": self.max_keys, "evictions": self.evictions}
+
+# Token bucket update run atomically in Redis, on Redis' clock so workers
+# on different hosts agree. Returns the wait as a string, since Redis
+# truncates Lua numbers to integers
+REDIS_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + (now - tonumber(bucket[2])) * refill_rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / refill_rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / refill_rate * 1000))
+return tostring(wait)
+"""
+
+class RedisBucketStore:
+    """
+    Token buckets shared by every worker through Redis.
+
+    A bucket expires once it would have refilled, so Redis only holds
+    clients seen recently. If Redis can't be reached, requests are let
+    through rather than failing the endpoint.
+    """
+
+    def __init__(self, url, prefix="rate_limit:"):
+        # Optional dependency, only needed for this backend
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.script = self.client.register_script(REDIS_TAKE_SCRIPT)
+        self.prefix = prefix
+        self.errors = 0
+
+    async def take(self, key, capacity, refill_rate):
+        try:
+            return float(await self.script(keys=[self.prefix + key], args=[capacity, refill_rate]))
+        except Exception as e:
+            self.errors += 1
+            print(f"Rate limit store error: {e}")
+            return 0.0
+
+    def stats(self):
+        return {"backend": "redis", "errors": self.errors}
+
+def store_from_env():
+    """Pick the bucket store from RATE_LIMIT_BACKEND ("memory" or "redis", which uses REDIS_URL)."""
+    if os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "redis":
+        return RedisBucketStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return MemoryBucketStore(int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+
+def client_address(scope, proxy_hops=RATE_LIMIT_PROXY_HOPS):
+    """The client's address: from X-Forwarded-For behind proxy_hops proxies, else the peer address."""
+    if proxy_hops > 0:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                addresses = [address.strip() for address in value.decode("latin-1").split(",")]
+                return addresses[max(len(addresses) - proxy_hops, 0)]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class RateLimiter:
+    """Per-client token buckets for POSTs to the RATE_LIMITS paths."""
+
+    def __init__(self, store, limits=RATE_LIMITS, proxy_hops=RATE_LIMIT_PROXY_HOPS):
+        self.store = store
+        self.limits = limits
+        self.proxy_hops = proxy_hops
+        self.allowed = 0
+        self.limited = 0
+
+    async def check(self, scope):
+        """
+        Take a token for an ASGI request.
+
+        Returns:
+            float: 0 if the request may proceed (or isn't limited), else seconds to wait
+        """
+        limit = self.limits.get(scope["path"]) if scope["method"] == "POST" else None
+        if limit is None:
+            return 0.0
+        wait = await self.store.take(f"{scope['path']}|{client_address(scope, self.proxy_hops)}", *limit)
+        if wait > 0:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self):
+        return {"enabled": RATE_LIMIT_ENABLED, "allowed": self.allowed, "limited": self.limited, **self.store.stats()}
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware answering over-limit requests with 429 and Retry-After.
+
+    The request is rejected before the endpoint runs, so it costs no
+    database connection, body parsing or email. Other requests pass
+    straight through.
+    """
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            wait = await self.limiter.check(scope)
+            if wait > 0:
+                body = b'{"detail":"Too many requests"}'
+                await send({
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(math.ceil(wait)).encode()),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+rate_limiter = RateLimiter(store_from_env())
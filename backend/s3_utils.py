@@ -1,11 +1,12 @@
 import os
-import uuid
+import threading
 import boto3
-import tempfile
-import shutil
+from botocore.config import Config
 from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 
+from metrics import s3_upload_seconds
+
 # Load environment variables
 load_dotenv()
 
@@ -14,77 +15,131 @@ AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-2")
+# Set to point at a local S3 stand-in (MinIO, moto server) in development and tests
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+
+# Connections kept open to S3, shared by every thread using the client
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+
+# Stored objects never change, since their keys are derived from their contents
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
 
 # Initialize S3 client
 def get_s3_client():
-    """Get and return an S3 client using the environment credentials."""
+    """
+    Get the S3 client shared by the process, creating it on first use.
+
+    Building a client resolves credentials and endpoints, which is slow,
+    so one client is created and reused. boto3 clients are thread-safe;
+    up to S3_MAX_POOL_CONNECTIONS requests share its connection pool.
+    """
+    global _s3_client
+    if _s3_client is not None:
+        return _s3_client
     if not all([AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_BUCKET_NAME]):
         raise ValueError("Missing required AWS environment variables")
     
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_KEY,
-        region_name=AWS_REGION
-    )
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client(
+                's3',
+                aws_access_key_id=AWS_ACCESS_KEY,
+                aws_secret_access_key=AWS_SECRET_KEY,
+                region_name=AWS_REGION,
+                endpoint_url=AWS_S3_ENDPOINT_URL,
+                config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 3, "mode": "standard"}
+                )
+            )
     
-    return s3_client
+    return _s3_client
+
+def public_url(key):
+    """Return the public URL of an object in the bucket."""
+    if AWS_S3_ENDPOINT_URL:
+        return f"{AWS_S3_ENDPOINT_URL.rstrip('/')}/{AWS_BUCKET_NAME}/{key}"
+    return f"https://{AWS_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
 
-def upload_file_to_s3(file, folder="uploads"):
+def key_from_url(url):
+    """Return the bucket key of one of our public URLs, or None for any other URL."""
+    if not AWS_BUCKET_NAME:
+        return None
+    prefix = public_url("")
+    if url and url.startswith(prefix) and len(url) > len(prefix):
+        return url[len(prefix):]
+    return None
+
+def create_presigned_post(key, content_type, max_bytes, expires_in=600):
     """
-    Upload a file to S3 bucket and return the public URL.
-    
+    Create a presigned POST that lets a browser upload one object straight to the bucket.
+
+    S3 itself rejects the upload unless it has exactly this key and
+    content type and is at most max_bytes long.
+
+    Returns:
+        dict: "url" to post to and the form "fields" to send before the file
+    """
+    return get_s3_client().generate_presigned_post(
+        AWS_BUCKET_NAME,
+        key,
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, max_bytes],
+        ],
+        ExpiresIn=expires_in
+    )
+
+def head_object(key):
+    """Return an object's metadata (ContentLength, ContentType, ...), or None if it doesn't exist."""
+    try:
+        return get_s3_client().head_object(Bucket=AWS_BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+def object_exists(key):
+    """Whether an object is already stored under key."""
+    return head_object(key) is not None
+
+def download_bytes(key):
+    """Return the contents of an object in the bucket."""
+    return get_s3_client().get_object(Bucket=AWS_BUCKET_NAME, Key=key)["Body"].read()
+
+def delete_object(key):
+    """Delete an object from the bucket (deleting a missing key is not an error)."""
+    get_s3_client().delete_object(Bucket=AWS_BUCKET_NAME, Key=key)
+
+def upload_bytes_to_s3(data, key, content_type):
+    """
+    Upload an in-memory object to S3 bucket and return the public URL.
+
+    Objects are stored as immutable, so key must identify the contents
+    (see images.content_id). This is blocking; call it from a thread pool inside async handlers.
+
     Args:
-        file: File object from FastAPI (UploadFile)
-        folder: Folder name within the bucket (default: "uploads")
-        
+        data: Object contents
+        key: Full key of the object within the bucket
+        content_type: MIME type stored with the object
+
     Returns:
-        str: Public URL of the uploaded file
+        str: Public URL of the uploaded object
     """
-    # Create a temporary file to use for the upload
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        # Read from the FastAPI UploadFile and write to our temp file
-        file.file.seek(0)
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_path = temp_file.name
-    
     try:
-        # Generate a unique filename
-        file_extension = file.filename.split(".")[-1]
-        unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-        
-        # Create the full file path in the bucket
-        file_path = f"{folder}/{unique_filename}"
-        
-        # Get the S3 client
-        s3_client = get_s3_client()
-        
-        # Upload the file using the temp file
-        with open(temp_file_path, 'rb') as upload_file:
-            s3_client.upload_fileobj(
-                upload_file, 
-                AWS_BUCKET_NAME, 
-                file_path,
-                ExtraArgs={
-                    "ContentType": file.content_type
-                    # Removed "ACL": "public-read" which was causing the error
-                }
+        with s3_upload_seconds.time(operation="put_object"):
+            get_s3_client().put_object(
+                Bucket=AWS_BUCKET_NAME,
+                Key=key,
+                Body=bytes(data),
+                ContentType=content_type,
+                CacheControl=IMMUTABLE_CACHE_CONTROL
             )
-        
-        # Generate and return the public URL
-        file_url = f"https://{AWS_BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{file_path}"
-        return file_url
-        
     except ClientError as e:
         print(f"Error uploading to S3: {e}")
         raise
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        raise
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        
-        # Reset file cursor position
-        file.file.seek(0) 
\ No newline at end of file
+    return public_url(key)
@@ -0,0 +1,538 @@
+import asyncio
+import bisect
+import math
+import os
+import re
+from collections import Counter, namedtuple
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+from database import Listing, Tag, listing_tags
+
+# "auto" uses SQLite FTS5 or MySQL FULLTEXT when the database has it and the
+# in-process index otherwise; "memory" always uses the in-process index
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+
+# Relevance weight of a match in each searchable field
+FIELD_WEIGHTS = {"make": 3.0, "model": 3.0, "tags": 2.0, "description": 1.0}
+
+MAX_SEARCH_RESULTS = 100
+MAX_SUGGESTIONS = 20
+
+# Most vocabulary words a trailing prefix expands to in the in-process index
+PREFIX_EXPANSION_LIMIT = 64
+
+# Most suggestion keys examined per autocomplete request
+AUTOCOMPLETE_SCAN_LIMIT = 2000
+
+# Words shorter than this aren't in MySQL's FULLTEXT index (innodb_ft_min_token_size)
+MYSQL_MIN_TOKEN_SIZE = 3
+
+SEARCH_TYPES = {"deals": "deal", "demos": "demo"}
+
+# Same word splitting as FTS5's unicode61 tokenizer: runs of letters and digits
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+# Words too common in queries to narrow anything down
+STOPWORDS = {"a", "an", "and", "the", "with", "for", "in", "on", "of", "to"}
+
+# Price phrases in a query, e.g. "under 400", "below $1,200", "over 2k"
+PRICE_PATTERN = re.compile(
+    r"(?P<op>under|below|less than|max|over|above|more than|min|from|<=?|>=?)\s*\$?\s*"
+    r"(?P<amount>\d[\d,]*(?:\.\d+)?)(?P<thousands>k\b)?"
+)
+MAX_PRICE_WORDS = ("under", "below", "less than", "max", "<", "<=")
+
+# Searchable fields of one listing, plus what search results are filtered and ranked by
+SearchDocument = namedtuple(
+    "SearchDocument", ["id", "listing_type", "make", "model", "tags", "description", "lease_price", "deal_score"]
+)
+
+# A search query split into words and price bounds
+ParsedQuery = namedtuple("ParsedQuery", ["terms", "prefix", "min_price", "max_price"])
+
+class SearchQuery(BaseModel):
+    """Query parameters accepted by GET /search."""
+    q: str = Field(..., min_length=1, max_length=200)
+    listing_type: Optional[Literal["deals", "demos"]] = None
+    limit: int = Field(20, ge=1, le=MAX_SEARCH_RESULTS)
+
+def tokenize(value):
+    """Split text into lowercase words."""
+    return TOKEN_PATTERN.findall((value or "").lower())
+
+def parse_query(query):
+    """
+    Split a shopper's query into search words and lease price bounds.
+
+    "hybrid AWD under 400" searches for "hybrid" and "awd" with a maximum
+    price of 400. Unless the query ends in a space, the last word is
+    treated as a prefix, so results follow the shopper as they type.
+    """
+    lowered = query.lower()
+    min_price = max_price = None
+    for match in PRICE_PATTERN.finditer(lowered):
+        amount = float(match.group("amount").replace(",", ""))
+        if match.group("thousands"):
+            amount *= 1000
+        if match.group("op") in MAX_PRICE_WORDS:
+            max_price = amount
+        else:
+            min_price = amount
+    remainder = PRICE_PATTERN.sub(" ", lowered)
+    terms = [term for term in tokenize(remainder) if term not in STOPWORDS]
+    prefix = bool(terms) and not remainder[-1:].isspace()
+    return ParsedQuery(terms, prefix, min_price, max_price)
+
+def listing_document(listing):
+    """Capture the searchable fields of a Deal or Demo."""
+    return SearchDocument(
+        listing.id, listing.listing_type, listing.make, listing.model,
+        tuple(tag.name for tag in listing.tags), listing.description,
+        listing.lease_price, listing.deal_score,
+    )
+
+async def load_documents(db):
+    """Read every listing's searchable fields with two column queries."""
+    tag_names = {}
+    for listing_id, name in await db.execute(
+        select(listing_tags.c.listing_id, Tag.name).join(Tag, Tag.id == listing_tags.c.tag_id).order_by(Tag.name)
+    ):
+        tag_names.setdefault(listing_id, []).append(name)
+    rows = await db.execute(select(
+        Listing.id, Listing.listing_type, Listing.make, Listing.model,
+        Listing.description, Listing.lease_price, Listing.deal_score,
+    ))
+    return [
+        SearchDocument(
+            row.id, row.listing_type, row.make, row.model, tuple(tag_names.get(row.id, ())),
+            row.description, row.lease_price, row.deal_score,
+        )
+        for row in rows
+    ]
+
+def _decrement(counter, key):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+class SortedKeys:
+    """A sorted list of distinct strings with reference counts, for prefix lookups with bisect."""
+
+    def __init__(self):
+        self.keys = []
+        self._counts = Counter()
+
+    def add(self, key):
+        if self._counts[key] == 0:
+            bisect.insort(self.keys, key)
+        self._counts[key] += 1
+
+    def remove(self, key):
+        _decrement(self._counts, key)
+        if key not in self._counts:
+            position = bisect.bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+
+    def with_prefix(self, prefix, limit):
+        """Return up to `limit` keys starting with prefix, in sorted order."""
+        position = bisect.bisect_left(self.keys, prefix)
+        matches = []
+        while position < len(self.keys) and len(matches) < limit and self.keys[position].startswith(prefix):
+            matches.append(self.keys[position])
+            position += 1
+        return matches
+
+def suggestion_key(value):
+    """Normalize text for prefix matching, so "Mercedes-Benz" and "mercedes benz" meet."""
+    return " ".join(tokenize(value))
+
+def _suggestions(document):
+    """(key, kind, display value) entries a listing contributes to autocomplete."""
+    entries = []
+    if document.make:
+        entries.append((suggestion_key(document.make), "make", document.make))
+    if document.model:
+        name = f"{document.make} {document.model}" if document.make else document.model
+        # Typing the model alone finds it too
+        entries.append((suggestion_key(name), "model", name))
+        entries.append((suggestion_key(document.model), "model", name))
+    entries.extend((suggestion_key(tag), "tag", tag) for tag in document.tags)
+    return [entry for entry in entries if entry[0]]
+
+class SuggestionIndex:
+    """
+    Makes, models and tags for autocomplete, with listing counts.
+
+    Keys are held in a sorted list, so a prefix lookup is a binary search
+    followed by a short forward scan.
+    """
+
+    def __init__(self):
+        self.keys = SortedKeys()
+        # key -> Counter of (kind, display value) -> listings
+        self.entries = {}
+
+    def add(self, document):
+        for key, kind, value in set(_suggestions(document)):
+            self.keys.add(key)
+            self.entries.setdefault(key, Counter())[(kind, value)] += 1
+
+    def remove(self, document):
+        for key, kind, value in set(_suggestions(document)):
+            self.keys.remove(key)
+            entries = self.entries[key]
+            _decrement(entries, (kind, value))
+            if not entries:
+                del self.entries[key]
+
+    def complete(self, prefix, limit):
+        """Return the most listed suggestions starting with prefix."""
+        prefix = suggestion_key(prefix)
+        if not prefix:
+            return []
+        found = Counter()
+        for key in self.keys.with_prefix(prefix, AUTOCOMPLETE_SCAN_LIMIT):
+            for entry, count in self.entries[key].items():
+                # A model is reachable by two keys; count its listings once
+                found[entry] = max(found[entry], count)
+        ranked = sorted(found.items(), key=lambda item: (-item[1], item[0][1].lower()))
+        return [{"value": value, "kind": kind, "count": count} for (kind, value), count in ranked[:limit]]
+
+class InvertedIndex:
+    """
+    In-process full-text index over listing documents.
+
+    Each word maps to the listings containing it and the weight of the
+    best field it appears in; the words themselves are kept sorted so a
+    trailing prefix expands with a binary search.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = {}
+        self.vocabulary = SortedKeys()
+
+    def add(self, document):
+        self.documents[document.id] = document
+        for term, weight in self._weights(document).items():
+            self.postings.setdefault(term, {})[document.id] = weight
+            self.vocabulary.add(term)
+
+    def remove(self, document):
+        self.documents.pop(document.id, None)
+        for term in self._weights(document):
+            postings = self.postings.get(term)
+            if postings is not None and postings.pop(document.id, None) is not None:
+                self.vocabulary.remove(term)
+                if not postings:
+                    del self.postings[term]
+
+    @staticmethod
+    def _weights(document):
+        weights = {}
+        fields = {
+            "make": document.make, "model": document.model,
+            "tags": " ".join(document.tags), "description": document.description,
+        }
+        for field, value in fields.items():
+            for term in tokenize(value):
+                weights[term] = max(weights.get(term, 0.0), FIELD_WEIGHTS[field])
+        return weights
+
+    def search(self, query, listing_type, limit):
+        """
+        Return the ids of the best matches for a parsed query.
+
+        Every word must match (the last one as a prefix when query.prefix
+        is set). Matches score the field weight times the word's inverse
+        document frequency, summed over the query's words.
+        """
+        total = len(self.documents)
+        scores = None
+        for position, term in enumerate(query.terms):
+            if query.prefix and position == len(query.terms) - 1:
+                expansions = self.vocabulary.with_prefix(term, PREFIX_EXPANSION_LIMIT)
+            else:
+                expansions = [term] if term in self.postings else []
+            term_scores = {}
+            for expansion in expansions:
+                postings = self.postings[expansion]
+                idf = math.log(1 + total / len(postings))
+                for listing_id, weight in postings.items():
+                    term_scores[listing_id] = max(term_scores.get(listing_id, 0.0), weight * idf)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {listing_id: score + term_scores[listing_id] for listing_id, score in scores.items() if listing_id in term_scores}
+            if not scores:
+                return []
+
+        matches = []
+        for listing_id, score in scores.items():
+            document = self.documents[listing_id]
+            if listing_type and document.listing_type != listing_type:
+                continue
+            if not _within_price(document.lease_price, query):
+                continue
+            matches.append((-score, _score_order(document.deal_score), listing_id))
+        matches.sort()
+        return [listing_id for _, _, listing_id in matches[:limit]]
+
+def _within_price(lease_price, query):
+    if query.min_price is None and query.max_price is None:
+        return True
+    if lease_price is None:
+        return False
+    if query.min_price is not None and lease_price < query.min_price:
+        return False
+    return query.max_price is None or lease_price <= query.max_price
+
+def _score_order(deal_score):
+    # Ties go to the better deal; unscored listings last
+    return math.inf if deal_score is None else deal_score
+
+class FullTextSearch:
+    """
+    Full-text search inside the database: an FTS5 table on SQLite or a
+    FULLTEXT-indexed table on MySQL, holding one row per listing.
+
+    The table is rebuilt from listings when the search index loads and
+    then kept current one listing at a time by the write endpoints.
+    """
+
+    def __init__(self, dialect):
+        self.dialect = dialect
+        # Column holding the listing id: FTS5 tables use their rowid
+        self.id_column = "rowid" if dialect == "sqlite" else "listing_id"
+
+    async def create(self, db):
+        """Create the search table if needed; raises OperationalError if the database lacks support."""
+        if self.dialect == "sqlite":
+            await db.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS listing_search "
+                "USING fts5(make, model, tags, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            ))
+        else:
+            await db.execute(text(
+                "CREATE TABLE IF NOT EXISTS listing_search ("
+                "listing_id INTEGER PRIMARY KEY, make VARCHAR(100), model VARCHAR(100), tags TEXT, description TEXT, "
+                "FULLTEXT KEY ft_listing_search (make, model, tags, description)"
+                ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+            ))
+        await db.commit()
+
+    def _fill(self, where=""):
+        # The listing's tag names, comma-separated (GROUP_CONCAT works on both databases)
+        return text(
+            f"INSERT INTO listing_search ({self.id_column}, make, model, tags, description) "
+            "SELECT listings.id, COALESCE(listings.make, ''), COALESCE(listings.model, ''), "
+            "COALESCE((SELECT group_concat(tags.name) FROM listing_tags "
+            "JOIN tags ON tags.id = listing_tags.tag_id WHERE listing_tags.listing_id = listings.id), ''), "
+            f"COALESCE(listings.description, '') FROM listings {where}"
+        )
+
+    async def rebuild(self, db):
+        """Replace the search table's rows with the current listings."""
+        await db.execute(text("DELETE FROM listing_search"))
+        await db.execute(self._fill())
+        await db.commit()
+
+    async def sync(self, db, listing_id):
+        """Refresh (or drop) one listing's row after it was written or deleted."""
+        await db.execute(text(f"DELETE FROM listing_search WHERE {self.id_column} = :id"), {"id": listing_id})
+        await db.execute(self._fill("WHERE listings.id = :id"), {"id": listing_id})
+        await db.commit()
+
+    async def search(self, db, query, listing_type, limit):
+        """Return the ids of the best matches for a parsed query, best first."""
+        params = {"limit": limit}
+        filters = []
+        if listing_type:
+            filters.append("listings.listing_type = :listing_type")
+            params["listing_type"] = listing_type
+        if query.min_price is not None:
+            filters.append("listings.lease_price >= :min_price")
+            params["min_price"] = query.min_price
+        if query.max_price is not None:
+            filters.append("listings.lease_price <= :max_price")
+            params["max_price"] = query.max_price
+
+        last = len(query.terms) - 1
+        if self.dialect == "sqlite":
+            # Each word is a quoted phrase (implicitly ANDed); "word"* matches a prefix
+            params["match"] = " ".join(
+                f'"{term}"' + ("*" if query.prefix and position == last else "")
+                for position, term in enumerate(query.terms)
+            )
+            weights = ", ".join(str(weight) for weight in FIELD_WEIGHTS.values())
+            statement = (
+                f"SELECT listings.id FROM listing_search JOIN listings ON listings.id = listing_search.rowid "
+                f"WHERE listing_search MATCH :match {''.join(' AND ' + clause for clause in filters)} "
+                f"ORDER BY bm25(listing_search, {weights}), "
+                "CASE WHEN listings.deal_score IS NULL THEN 1 ELSE 0 END, listings.deal_score, listings.id LIMIT :limit"
+            )
+        else:
+            indexed, short = [], []
+            for position, term in enumerate(query.terms):
+                is_prefix = query.prefix and position == last
+                if len(term) >= MYSQL_MIN_TOKEN_SIZE:
+                    indexed.append(f"+{term}" + ("*" if is_prefix else ""))
+                else:
+                    short.append(term)
+            # Words too short for the FULLTEXT index are matched with LIKE instead
+            for number, term in enumerate(short):
+                filters.append(f"CONCAT_WS(' ', listing_search.make, listing_search.model, listing_search.tags, listing_search.description) LIKE :short{number}")
+                params[f"short{number}"] = f"%{term}%"
+            relevance = "0"
+            if indexed:
+                relevance = "MATCH(listing_search.make, listing_search.model, listing_search.tags, listing_search.description) AGAINST (:match IN BOOLEAN MODE)"
+                filters.insert(0, relevance)
+                params["match"] = " ".join(indexed)
+            statement = (
+                f"SELECT listings.id, {relevance} AS relevance FROM listing_search "
+                "JOIN listings ON listings.id = listing_search.listing_id "
+                f"WHERE {' AND '.join(filters)} "
+                "ORDER BY relevance DESC, listings.deal_score IS NULL, listings.deal_score, listings.id LIMIT :limit"
+            )
+        return [row[0] for row in await db.execute(text(statement), params)]
+
+class ListingSearch:
+    """
+    Search and autocomplete over deals and demos.
+
+    Autocomplete is always answered from the in-process SuggestionIndex.
+    Search uses FullTextSearch when the database supports it and
+    SEARCH_BACKEND allows it, and the in-process InvertedIndex otherwise.
+    Like FacetIndex, the indexes are built on first use and kept current
+    by the write endpoints through saved/deleted.
+    """
+
+    def __init__(self, backend=SEARCH_BACKEND):
+        self.backend = backend
+        self.loaded = False
+        self.documents = {}
+        self.suggestions = SuggestionIndex()
+        self.inverted = None
+        self.fulltext = None
+        self._lock = asyncio.Lock()
+        # Incremented on every write so a load racing a write can tell it missed one
+        self._generation = 0
+
+    async def load(self, db):
+        """Build the indexes from the database unless they are already loaded."""
+        if self.loaded:
+            return
+        async with self._lock:
+            if self.loaded:
+                return
+            generation = self._generation
+            fulltext = None
+            dialect = db.get_bind().dialect.name
+            if self.backend != "memory" and dialect in ("sqlite", "mysql"):
+                fulltext = FullTextSearch(dialect)
+                try:
+                    await fulltext.create(db)
+                    await fulltext.rebuild(db)
+                except OperationalError as e:
+                    await db.rollback()
+                    print(f"Full-text search unavailable, using the in-process index: {e}")
+                    fulltext = None
+
+            documents = {document.id: document for document in await load_documents(db)}
+            suggestions = SuggestionIndex()
+            inverted = None if fulltext else InvertedIndex()
+            for document in documents.values():
+                suggestions.add(document)
+                if inverted is not None:
+                    inverted.add(document)
+
+            # A write committed while we were reading; leave the index
+            # unloaded so the next request reads again
+            if generation != self._generation:
+                return
+            self.documents, self.suggestions, self.inverted, self.fulltext = documents, suggestions, inverted, fulltext
+            self.loaded = True
+
+    def _forget(self, listing_id):
+        previous = self.documents.pop(listing_id, None)
+        if previous is not None:
+            self.suggestions.remove(previous)
+            if self.inverted is not None:
+                self.inverted.remove(previous)
+
+    async def saved(self, db, listing):
+        """Index a newly created or updated listing."""
+        self._generation += 1
+        if not self.loaded:
+            return
+        document = listing_document(listing)
+        self._forget(document.id)
+        self.documents[document.id] = document
+        self.suggestions.add(document)
+        if self.inverted is not None:
+            self.inverted.add(document)
+        await self._sync(db, document.id)
+
+    async def deleted(self, db, listing_id):
+        """Drop a deleted listing from the indexes."""
+        self._generation += 1
+        if not self.loaded:
+            return
+        self._forget(listing_id)
+        await self._sync(db, listing_id)
+
+    async def _sync(self, db, listing_id):
+        if self.fulltext is None:
+            return
+        try:
+            await self.fulltext.sync(db, listing_id)
+        except Exception as e:
+            # The listing itself is saved; rebuild the search table on the next search
+            await db.rollback()
+            print(f"Error updating search index for listing {listing_id}: {str(e)}")
+            self.invalidate()
+
+    def invalidate(self):
+        """Drop the indexes after a bulk change, so the next request rebuilds them."""
+        self._generation += 1
+        self.loaded = False
+
+    async def search(self, db, params: SearchQuery):
+        """
+        Return the ids of the listings best matching a search, best first.
+
+        A query with only a price phrase ("under 400") lists the best
+        deals in that range.
+        """
+        await self.load(db)
+        query = parse_query(params.q)
+        listing_type = SEARCH_TYPES.get(params.listing_type)
+        if not query.terms:
+            return await self._browse(db, query, listing_type, params.limit)
+        if self.fulltext is not None:
+            return await self.fulltext.search(db, query, listing_type, params.limit)
+        return self.inverted.search(query, listing_type, params.limit)
+
+    async def _browse(self, db, query, listing_type, limit):
+        if query.min_price is None and query.max_price is None:
+            return []
+        statement = select(Listing.id).where(Listing.deal_score.isnot(None))
+        if listing_type:
+            statement = statement.where(Listing.listing_type == listing_type)
+        if query.min_price is not None:
+            statement = statement.where(Listing.lease_price >= query.min_price)
+        if query.max_price is not None:
+            statement = statement.where(Listing.lease_price <= query.max_price)
+        statement = statement.order_by(Listing.deal_score, Listing.id).limit(limit)
+        return list((await db.execute(statement)).scalars())
+
+    async def autocomplete(self, db, prefix, limit):
+        """Return makes, models and tags starting with prefix, most listed first."""
+        await self.load(db)
+        return self.suggestions.complete(prefix, limit)
+
+listing_search = ListingSearch()
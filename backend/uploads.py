@@ -0,0 +1,216 @@
+import re
+import uuid
+from typing import Literal
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_utils import create_presigned_post, head_object, key_from_url
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Largest image accepted by the upload endpoints
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+# Allowance for multipart boundaries and part headers when checking Content-Length
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+# Content types the browser may upload directly to the bucket, and their extensions
+DIRECT_UPLOAD_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+# How long a presigned upload stays valid, in seconds
+PRESIGNED_UPLOAD_EXPIRES = 600
+
+# Keys handed out for direct uploads: <folder>/originals/<random hex>.<ext>
+DIRECT_UPLOAD_KEY_PATTERN = re.compile(r"^(deals|demos)/originals/[0-9a-f]{32}\.(jpg|png|gif|webp)$")
+
+# OpenAPI description of the upload body, since the endpoints read it themselves
+IMAGE_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+class ReceivedFile:
+    """A file field read from a multipart request body."""
+
+    def __init__(self):
+        self.filename = None
+        self.content_type = None
+        self.data = bytearray()
+
+class _ImageFieldReader:
+    """Collects one file field from multipart parser callbacks, enforcing the image checks as it goes."""
+
+    def __init__(self, field_name, max_bytes):
+        self.field_name = field_name
+        self.max_bytes = max_bytes
+        self.file = None
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._current = None
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._current = None
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name", b"").decode("latin-1") != self.field_name or self.file is not None:
+            return
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        # Reject before reading the file's contents
+        if not content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        self.file = ReceivedFile()
+        self.file.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+        self.file.content_type = content_type
+        self._current = self.file
+
+    def on_part_data(self, data, start, end):
+        if self._current is None:
+            return
+        if len(self._current.data) + (end - start) > self.max_bytes:
+            raise HTTPException(status_code=400, detail="File size exceeds the 5MB limit")
+        self._current.data += data[start:end]
+
+async def receive_image(request: Request, field_name="file", max_bytes=MAX_IMAGE_BYTES):
+    """
+    Read an image field from a multipart request as the body streams in.
+
+    Oversized uploads are refused from the Content-Length header when the
+    client sends one, and otherwise as soon as the file passes max_bytes,
+    without reading the rest of the body. Only the file's own bytes are
+    kept, in memory.
+
+    Args:
+        request: Incoming multipart/form-data request
+        field_name: Name of the form field holding the image
+        max_bytes: Largest accepted file size
+
+    Returns:
+        ReceivedFile: The file's name, content type and bytes
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=400, detail="File size exceeds the 5MB limit")
+
+    reader = _ImageFieldReader(field_name, max_bytes)
+    parser = MultipartParser(boundary, reader.callbacks())
+    async for chunk in request.stream():
+        parser.write(chunk)
+    parser.finalize()
+
+    if reader.file is None:
+        raise HTTPException(status_code=400, detail=f"Missing file field '{field_name}'")
+    return reader.file
+
+class PresignUploadRequest(BaseModel):
+    folder: Literal["deals", "demos"]
+    content_type: str
+
+class CompleteUploadRequest(BaseModel):
+    key: str
+
+def presign_upload(params: PresignUploadRequest):
+    """
+    Issue a presigned POST for uploading one listing image straight to S3.
+
+    Returns:
+        dict: The bucket "key", the "url" and form "fields" to post, and "expires_in"
+    """
+    extension = DIRECT_UPLOAD_TYPES.get(params.content_type)
+    if extension is None:
+        raise HTTPException(status_code=400, detail="File must be a JPEG, PNG, GIF or WebP image")
+    key = f"{params.folder}/originals/{uuid.uuid4().hex}.{extension}"
+    post = create_presigned_post(key, params.content_type, MAX_IMAGE_BYTES, PRESIGNED_UPLOAD_EXPIRES)
+    return {"key": key, "url": post["url"], "fields": post["fields"], "expires_in": PRESIGNED_UPLOAD_EXPIRES}
+
+def check_uploaded_object(key, allow_any_key=False):
+    """
+    Check with a HEAD request that an uploaded image exists and is within limits.
+
+    This is blocking; call it from a thread pool inside async handlers.
+
+    Args:
+        key: Bucket key of the object
+        allow_any_key: Accept keys other than ones issued by presign_upload
+
+    Returns:
+        dict: The object's metadata
+
+    Raises:
+        HTTPException: 400 if the image is missing or invalid, 502 if S3 can't be reached
+    """
+    if not allow_any_key and not DIRECT_UPLOAD_KEY_PATTERN.match(key):
+        raise HTTPException(status_code=400, detail="Unknown upload key")
+    try:
+        metadata = head_object(key)
+    except ValueError as e:
+        # Missing AWS settings
+        raise HTTPException(status_code=502, detail=f"Image storage is not configured: {str(e)}")
+    except (ClientError, BotoCoreError) as e:
+        print(f"Error checking uploaded image {key}: {e}")
+        raise HTTPException(status_code=502, detail=f"Could not check the uploaded image: {str(e)}")
+    if metadata is None:
+        raise HTTPException(status_code=400, detail="Image has not been uploaded")
+    if not 0 < metadata["ContentLength"] <= MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=400, detail="File size exceeds the 5MB limit")
+    if not metadata.get("ContentType", "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    return metadata
+
+async def verify_image_url(image_url):
+    """
+    Make sure an image_url that points into our bucket refers to an uploaded image.
+
+    URLs outside the bucket are accepted unchecked, as before.
+    """
+    key = key_from_url(image_url)
+    if key is not None:
+        await run_in_threadpool(check_uploaded_object, key, True)
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal, env_flag
+
+# Upper bounds of the flush-size histogram buckets
+FLUSH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+class WritePipeline:
+    """
+    Group-commit queue for form and inquiry submissions.
+
+    Requests hand over the rows they want inserted and wait. A single
+    flusher task collects whatever arrives within max_delay_ms (or until
+    max_rows are waiting) and writes it with one bulk INSERT per table in
+    one transaction, so a spike costs one commit per batch instead of one
+    per lead. Each request is released only after its batch commits.
+    """
+
+    def __init__(self, session_factory, enabled=False, max_rows=100, max_delay_ms=10):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = None
+        self._task = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failed_batches = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.flush_sizes = OrderedDict((bucket, 0) for bucket in FLUSH_SIZE_BUCKETS + (float("inf"),))
+
+    async def start(self):
+        """Start the flusher task if batching is enabled."""
+        if not self.enabled or self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued and stop the flusher task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, rows):
+        """
+        Queue rows for insertion and wait until they are committed.
+
+        Args:
+            rows: List of (model class, column values dict) that must be
+                written in the same transaction
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            row_count = len(item[0])
+            deadline = loop.time() + self.max_delay
+            while row_count < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                row_count += len(item[0])
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Keep the flusher alive; fail whatever the batch left unanswered
+                print(f"Error flushing batch of {len(batch)} submissions: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            await self._insert([row for rows, _ in batch for row in rows])
+        except Exception as e:
+            # Retry each request on its own so one bad row only fails its own request
+            print(f"Error flushing batch of {len(batch)} submissions, retrying individually: {e}")
+            self.failed_batches += 1
+            for rows, future in batch:
+                try:
+                    await self._insert(rows)
+                    error = None
+                except Exception as row_error:
+                    error = row_error
+                # The submitter may have been cancelled (e.g. the client disconnected)
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+        self._record_flush(sum(len(rows) for rows, _ in batch), time.perf_counter() - start)
+
+    async def _insert(self, rows):
+        """Insert rows with one executemany INSERT per table, in a single transaction."""
+        by_model = OrderedDict()
+        for model, values in rows:
+            by_model.setdefault(model, []).append(values)
+        async with self.session_factory() as db:
+            async with db.begin():
+                for model, values in by_model.items():
+                    await db.execute(insert(model), values)
+
+    def _record_flush(self, size, seconds):
+        self.flushes += 1
+        self.rows_flushed += size
+        self.flush_seconds_total += seconds
+        self.flush_seconds_max = max(self.flush_seconds_max, seconds)
+        for bucket in self.flush_sizes:
+            if size <= bucket:
+                self.flush_sizes[bucket] += 1
+                break
+
+    def stats(self):
+        """Return flush counts, sizes and latency."""
+        return {
+            "enabled": self.enabled,
+            "max_rows": self.max_rows,
+            "max_delay_ms": self.max_delay * 1000,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "failed_batches": self.failed_batches,
+            "mean_flush_size": self.rows_flushed / self.flushes if self.flushes else 0.0,
+            "flush_ms": {
+                "mean": self.flush_seconds_total / self.flushes * 1000 if self.flushes else 0.0,
+                "max": self.flush_seconds_max * 1000,
+            },
+            "flush_size_histogram": {
+                ("+Inf" if bucket == float("inf") else str(bucket)): count
+                for bucket, count in self.flush_sizes.items()
+            },
+        }
+
+write_pipeline = WritePipeline(
+    AsyncSessionLocal,
+    enabled=env_flag("WRITE_BATCHING_ENABLED", "false"),
+    max_rows=int(os.getenv("WRITE_BATCH_MAX_ROWS", "100")),
+    max_delay_ms=float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "10")),
+)
@@ -10,4 +10,27 @@ const api = axios.create({
   }
 });
 
-export default api; 
\ No newline at end of file
+export default api;
+
+/**
+ * Upload a listing image straight to S3 with a presigned POST, then have
+ * the API verify it and build its resized variants.
+ * Returns the image URL to store on the deal or demo.
+ */
+export const uploadListingImage = async (file: File, folder: 'deals' | 'demos'): Promise<string> => {
+  const presigned = await api.post('/uploads/presign', {
+    folder,
+    content_type: file.type
+  });
+
+  const formData = new FormData();
+  Object.entries(presigned.data.fields as Record<string, string>).forEach(([name, value]) => {
+    formData.append(name, value);
+  });
+  // S3 requires the file to be the last field
+  formData.append('file', file);
+  await axios.post(presigned.data.url, formData);
+
+  const completed = await api.post('/uploads/complete', { key: presigned.data.key });
+  return completed.data.image_url;
+};
@@ -12,6 +12,9 @@ import {
 } from '@mui/material';
 import { Deal } from '../types/deals';
 
+// Cards are full width on phones and roughly a third of the page otherwise
+const CARD_IMAGE_SIZES = '(max-width: 600px) 100vw, 33vw';
+
 interface DealCardProps {
   deal: Deal;
   onDealClick?: (deal: Deal) => void;
@@ -36,12 +39,19 @@ const DealCard: React.FC<DealCardProps> = ({ deal, onDealClick }) => {
       }
     }}>
       <Box sx={{ position: 'relative' }}>
-        <CardMedia
-          component="img"
-          height="200"
-          image={deal.image_url}
-          alt={`${deal.year} ${deal.make} ${deal.model}`}
-        />
+        <CardMedia component="picture" sx={{ display: 'block', height: 200 }}>
+          {deal.image_srcset && (
+            <source type="image/webp" srcSet={deal.image_srcset.webp} sizes={CARD_IMAGE_SIZES} />
+          )}
+          <img
+            src={deal.image_url}
+            srcSet={deal.image_srcset?.jpeg}
+            sizes={CARD_IMAGE_SIZES}
+            alt={`${deal.year} ${deal.make} ${deal.model}`}
+            loading="lazy"
+            style={{ width: '100%', height: '100%', objectFit: 'cover', display: 'block' }}
+          />
+        </CardMedia>
         {deal.savings && (
           <Box 
             sx={{ 
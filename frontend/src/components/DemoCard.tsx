@@ -12,6 +12,9 @@ import {
 } from '@mui/material';
 import { Demo } from '../types/demos';
 
+// Cards are full width on phones and roughly a third of the page otherwise
+const CARD_IMAGE_SIZES = '(max-width: 600px) 100vw, 33vw';
+
 interface DemoCardProps {
   demo: Demo;
   onDemoClick?: (demo: Demo) => void;
@@ -36,12 +39,19 @@ const DemoCard: React.FC<DemoCardProps> = ({ demo, onDemoClick }) => {
       }
     }}>
       <Box sx={{ position: 'relative' }}>
-        <CardMedia
-          component="img"
-          height="200"
-          image={demo.image_url}
-          alt={`${demo.year} ${demo.make} ${demo.model}`}
-        />
+        <CardMedia component="picture" sx={{ display: 'block', height: 200 }}>
+          {demo.image_srcset && (
+            <source type="image/webp" srcSet={demo.image_srcset.webp} sizes={CARD_IMAGE_SIZES} />
+          )}
+          <img
+            src={demo.image_url}
+            srcSet={demo.image_srcset?.jpeg}
+            sizes={CARD_IMAGE_SIZES}
+            alt={`${demo.year} ${demo.make} ${demo.model}`}
+            loading="lazy"
+            style={{ width: '100%', height: '100%', objectFit: 'cover', display: 'block' }}
+          />
+        </CardMedia>
         {demo.savings && (
           <Box 
             sx={{ 
@@ -30,7 +30,7 @@ import DeleteIcon from '@mui/icons-material/Delete';
 import EditIcon from '@mui/icons-material/Edit';
 import AddIcon from '@mui/icons-material/Add';
 import { useNavigate } from 'react-router-dom';
-import api from '../api';
+import api, { uploadListingImage } from '../api';
 
 interface DealFormData {
   make: string;
@@ -306,17 +306,8 @@ const AdminPage: React.FC = () => {
     try {
       setDealSubmitting(true);
       
-      // First, upload the image
-      const formData = new FormData();
-      formData.append('file', dealImageFile);
-      
-      const imageResponse = await api.post('/upload/deal-image/', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        }
-      });
-      
-      const imageUrl = imageResponse.data.image_url;
+      // First, upload the image straight to S3
+      const imageUrl = await uploadListingImage(dealImageFile, 'deals');
       
       // Then, create the deal with the image URL as part of the JSON payload
       const dealDataWithImage = {
@@ -353,17 +344,8 @@ const AdminPage: React.FC = () => {
     try {
       setDemoSubmitting(true);
       
-      // First, upload the image
-      const formData = new FormData();
-      formData.append('file', demoImageFile);
-      
-      const imageResponse = await api.post('/upload/demo-image/', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        }
-      });
-      
-      const imageUrl = imageResponse.data.image_url;
+      // First, upload the image straight to S3
+      const imageUrl = await uploadListingImage(demoImageFile, 'demos');
       
       // Then, create the demo with the image URL as part of the JSON payload
       const demoDataWithImage = {
@@ -484,20 +466,7 @@ const AdminPage: React.FC = () => {
       
       // If a new image was selected, upload it first
       if (editImageFile) {
-        const formData = new FormData();
-        formData.append('file', editImageFile);
-        
-        const uploadEndpoint = type === 'deal' 
-          ? '/upload/deal-image/' 
-          : '/upload/demo-image/';
-        
-        const imageResponse = await api.post(uploadEndpoint, formData, {
-          headers: {
-            'Content-Type': 'multipart/form-data',
-          }
-        });
-        
-        imageUrl = imageResponse.data.image_url;
+        imageUrl = await uploadListingImage(editImageFile, type === 'deal' ? 'deals' : 'demos');
       }
       
       // Create update payload with the image URL (either new or existing)
@@ -20,6 +20,8 @@ export interface Deal {
   savings?: number;
   tags?: string[];
   description?: string;
+  // Resized variants of image_url, if it was uploaded with them
+  image_srcset?: { webp: string; jpeg: string } | null;
 }
 
 // // You can also export sample/mock data from here to use across components
@@ -19,6 +19,8 @@ export interface Demo {
   savings?: number;
   tags?: string[];
   description?: string;
+  // Resized variants of image_url, if it was uploaded with them
+  image_srcset?: { webp: string; jpeg: string } | null;
 }
 
 // // Mock data for demo vehicles